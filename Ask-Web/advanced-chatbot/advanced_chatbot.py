@@ -2,39 +2,40 @@
 # Enhanced with Image OCR, Voice Interaction, Persistent Storage & Advanced Scraping
 
 import streamlit as st
-import selenium
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from bs4 import BeautifulSoup
-import google.generativeai as genai
-from sentence_transformers import SentenceTransformer, util
 import torch
 import requests
-from urllib.parse import urljoin, urlparse
 import time
 import re
 import os
 import io
 import base64
+import hashlib
+import json
+import wave
 import threading
 import asyncio
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from collections import OrderedDict, deque
 from dotenv import load_dotenv
 from streamlit_webrtc import webrtc_streamer
 
 
 # Advanced imports for new features
-import chromadb
-from chromadb.config import Settings
-import easyocr
-import pytesseract
-from PIL import Image
 import speech_recognition as sr
 from gtts import gTTS
-import tempfile
+
+# Crawl, storage and retrieval pipeline (shared with benchmark.py and query_service.py)
+from chatbot_pipeline import (
+    AdvancedWebsiteScraper,
+    PersistentVectorStorage,
+    VECTOR_BACKENDS,
+    generate_response_with_gemini,
+    metrics,
+    set_reporter,
+    site_key,
+)
+
+# Show pipeline errors and progress messages in the app
+set_reporter(st)
 
 # Load environment variables
 load_dotenv()
@@ -64,474 +65,401 @@ if "last_url" not in st.session_state:
     st.session_state.last_url = ""
 if "voice_enabled" not in st.session_state:
     st.session_state.voice_enabled = False
+if "voice" not in st.session_state:
+    st.session_state.voice = None
 
-class AdvancedWebsiteScraper:
-    def __init__(self, use_gpu_ocr=True):
-        self.setup_drivers()
-        self.setup_ocr(use_gpu_ocr)
-        
-    def setup_drivers(self):
-        """Setup multiple Chrome drivers for parallel scraping"""
-        self.drivers = []
-        self.max_drivers = 3  # Limit to prevent resource exhaustion
-        
-    def get_driver(self):
-        """Get or create a Chrome driver"""
-        chrome_options = Options()
-        chrome_options.add_argument("--headless")
-        chrome_options.add_argument("--no-sandbox")
-        chrome_options.add_argument("--disable-dev-shm-usage")
-        chrome_options.add_argument("--disable-gpu")
-        chrome_options.add_argument("--window-size=1920,1080")
-        chrome_options.add_argument("--disable-images")  # Skip images for faster loading
-        chrome_options.add_argument("--user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36")
-        
-        try:
-            driver = webdriver.Chrome(options=chrome_options)
-            driver.implicitly_wait(5)
-            return driver
-        except Exception as e:
-            st.error(f"Error setting up Chrome driver: {e}")
-            return None
+class SpeechBackend:
+    """Base class for speech engines with warm model caching and latency metrics"""
+    name = "base"
+    stage = "speech"
+    # Loaded models shared across sessions, keyed by (backend name, model id)
+    model_cache = {}
+    model_cache_lock = threading.Lock()
     
-    def setup_ocr(self, use_gpu=True):
-        """Setup OCR engines"""
-        self.use_gpu_ocr = use_gpu
-        try:
-            if use_gpu:
-                # EasyOCR - better for GPU
-                self.ocr_reader = easyocr.Reader(['en'])
-                st.success("✅ EasyOCR (GPU) initialized")
-            else:
-                # Tesseract - better for CPU
-                self.ocr_reader = None
-                st.success("✅ Tesseract (CPU) ready")
-        except Exception as e:
-            st.warning(f"OCR setup warning: {e}")
-            self.ocr_reader = None
-    
-    def extract_text_from_images(self, driver):
-        """Extract text from images on the current page"""
-        extracted_texts = []
-        
-        try:
-            # Find all images on the page
-            images = driver.find_elements(By.TAG_NAME, "img")
-            
-            for i, img in enumerate(images[:5]):  # Limit to first 5 images
-                try:
-                    # Get image src
-                    img_src = img.get_attribute("src")
-                    if not img_src or img_src.startswith("data:"):
-                        continue
-                    
-                    # Download image
-                    response = requests.get(img_src, timeout=10)
-                    if response.status_code == 200:
-                        # Convert to PIL Image
-                        pil_img = Image.open(io.BytesIO(response.content))
-                        
-                        # Extract text using OCR
-                        if self.use_gpu_ocr and self.ocr_reader:
-                            # EasyOCR
-                            results = self.ocr_reader.readtext(response.content)
-                            text = " ".join([result[1] for result in results])
-                        else:
-                            # Tesseract
-                            text = pytesseract.image_to_string(pil_img)
-                        
-                        if text.strip():
-                            extracted_texts.append(f"Image {i+1}: {text.strip()}")
-                            
-                except Exception as e:
-                    continue
-                    
-        except Exception as e:
-            st.warning(f"Image OCR error: {e}")
-            
-        return extracted_texts
-    
-    def normalize_url(self, url):
-        """Normalize URL by removing fragments and normalizing case"""
-        parsed = urlparse(url)
-        normalized = f"{parsed.scheme}://{parsed.netloc.lower()}{parsed.path}"
-        if parsed.query:
-            normalized += f"?{parsed.query}"
-        return normalized.rstrip('/')
-    
-    def is_same_domain(self, url1, url2):
-        """Check if two URLs belong to the same domain"""
-        domain1 = urlparse(url1).netloc.lower().replace('www.', '')
-        domain2 = urlparse(url2).netloc.lower().replace('www.', '')
-        return domain1 == domain2
-    
-    def is_valid_url(self, url):
-        """Check if URL is valid for scraping"""
-        if not url:
-            return False
-        
-        parsed = urlparse(url)
-        if not parsed.scheme or not parsed.netloc:
-            return False
-            
-        # Skip certain file types
-        skip_extensions = ['.pdf', '.jpg', '.jpeg', '.png', '.gif', '.zip', '.doc', '.docx', '.mp4', '.avi']
-        if any(url.lower().endswith(ext) for ext in skip_extensions):
-            return False
-            
-        return True
+    def __init__(self, model_id=None):
+        self.model_id = model_id
+        self.latencies = deque(maxlen=200)
+        self.errors = 0
+        self.load_time = None
     
-    def scrape_single_page(self, url, extract_images=True):
-        """Scrape content from a single page with image OCR"""
-        driver = self.get_driver()
-        if not driver:
-            return None
-            
-        try:
-            driver.get(url)
-            time.sleep(2)
-            
-            # Wait for page to load
-            WebDriverWait(driver, 10).until(
-                EC.presence_of_element_located((By.TAG_NAME, "body"))
-            )
-            
-            # Get page source and parse with BeautifulSoup
-            soup = BeautifulSoup(driver.page_source, 'html.parser')
-            
-            # Remove unwanted elements
-            for element in soup(["script", "style", "nav", "footer", "header", "sidebar", "aside", "ads"]):
-                element.decompose()
-            
-            # Extract title
-            title = soup.title.string if soup.title else "No Title"
-            
-            # Extract main content
-            content = soup.get_text()
-            lines = (line.strip() for line in content.splitlines())
-            content = ' '.join(line for line in lines if line)
-            
-            # Extract text from images if enabled
-            image_texts = []
-            if extract_images:
-                image_texts = self.extract_text_from_images(driver)
-            
-            # Combine regular content and image text
-            full_content = content
-            if image_texts:
-                full_content += "\n\nText from Images:\n" + "\n".join(image_texts)
-            
-            if len(full_content.strip()) > 100:
-                return {
-                    'url': url,
-                    'title': title.strip(),
-                    'content': full_content[:12000],  # Increased limit for image content
-                    'image_count': len(image_texts)
-                }
-                
-        except Exception as e:
-            st.warning(f"Error scraping {url}: {e}")
-        finally:
-            driver.quit()
-            
+    def load_model(self):
+        """Load the engine's model; backends without a local model return None"""
         return None
     
-    def parallel_scrape_pages(self, urls, max_workers=3, extract_images=True):
-        """Scrape multiple pages in parallel"""
-        scraped_content = []
-        
-        progress_bar = st.progress(0)
-        status_text = st.empty()
-        
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            # Submit scraping jobs
-            future_to_url = {
-                executor.submit(self.scrape_single_page, url, extract_images): url 
-                for url in urls
-            }
-            
-            completed = 0
-            total = len(urls)
-            
-            for future in as_completed(future_to_url):
-                completed += 1
-                url = future_to_url[future]
-                
-                status_text.text(f"Scraping page {completed}/{total}: {url}")
-                progress_bar.progress(completed / total)
-                
-                try:
-                    result = future.result()
-                    if result:
-                        scraped_content.append(result)
-                except Exception as e:
-                    st.warning(f"Error scraping {url}: {e}")
-        
-        progress_bar.empty()
-        status_text.empty()
-        
-        return scraped_content
-    
-    def intelligent_url_discovery(self, base_url, max_pages=20):
-        """Intelligent URL discovery with prioritization"""
-        discovered_urls = set()
-        priority_patterns = [
-            '/about', '/services', '/products', '/blog', '/news', '/faq', 
-            '/contact', '/help', '/docs', '/documentation', '/api'
-        ]
-        
-        driver = self.get_driver()
-        if not driver:
-            return [base_url]
-        
+    def get_model(self):
+        """Return the warm model, loading it once per process"""
+        key = (self.name, self.model_id)
+        with self.model_cache_lock:
+            if key not in self.model_cache:
+                started = time.perf_counter()
+                self.model_cache[key] = self.load_model()
+                self.load_time = time.perf_counter() - started
+            return self.model_cache[key]
+    
+    def timed(self, func, *args):
+        """Run a backend call and record its latency"""
+        started = time.perf_counter()
         try:
-            driver.get(base_url)
-            time.sleep(2)
-            
-            # Get all links
-            links = driver.find_elements(By.TAG_NAME, "a")
-            base_domain = urlparse(base_url).netloc.lower().replace('www.', '')
-            
-            prioritized_urls = []
-            regular_urls = []
-            
-            for link in links:
-                try:
-                    href = link.get_attribute("href")
-                    if not href:
-                        continue
-                    
-                    absolute_url = urljoin(base_url, href)
-                    normalized_url = self.normalize_url(absolute_url)
-                    
-                    if (self.is_valid_url(absolute_url) and 
-                        self.is_same_domain(absolute_url, base_url) and
-                        normalized_url not in discovered_urls):
-                        
-                        discovered_urls.add(normalized_url)
-                        
-                        # Prioritize URLs with important patterns
-                        if any(pattern in normalized_url.lower() for pattern in priority_patterns):
-                            prioritized_urls.append(absolute_url)
-                        else:
-                            regular_urls.append(absolute_url)
-                            
-                except Exception:
-                    continue
-            
-            # Combine prioritized and regular URLs
-            all_urls = [base_url] + prioritized_urls + regular_urls
-            return all_urls[:max_pages]
-            
-        except Exception as e:
-            st.warning(f"Error discovering URLs: {e}")
-            return [base_url]
+            return func(*args)
+        except Exception:
+            self.errors += 1
+            raise
         finally:
-            driver.quit()
+            elapsed = time.perf_counter() - started
+            self.latencies.append(elapsed)
+            metrics.observe(f"{self.stage}_{self.name}", elapsed)
+    
+    def get_stats(self):
+        """Latency summary for the sidebar"""
+        if not self.latencies:
+            return {'calls': 0, 'errors': self.errors}
+        ordered = sorted(self.latencies)
+        return {
+            'calls': len(ordered),
+            'errors': self.errors,
+            'avg_ms': 1000 * sum(ordered) / len(ordered),
+            'p95_ms': 1000 * ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)],
+            'last_ms': 1000 * self.latencies[-1]
+        }
+
+class GoogleSpeechToText(SpeechBackend):
+    """Google Web Speech API (network)"""
+    name = "google"
+    stage = "stt"
+    
+    def transcribe(self, recognizer, audio_data):
+        return self.timed(recognizer.recognize_google, audio_data)
+
+class VoskSpeechToText(SpeechBackend):
+    """Offline Kaldi-based recognition with a local Vosk model directory"""
+    name = "vosk"
+    stage = "stt"
+    sample_rate = 16000
+    
+    def load_model(self):
+        from vosk import Model
+        # Model(lang=...) would download; offline nodes must point at an unpacked model
+        if not self.model_id or not os.path.isdir(self.model_id):
+            raise ValueError(f"Vosk requires a local model directory (VOSK_MODEL_PATH), got: {self.model_id!r}")
+        return Model(self.model_id)
+    
+    def recognize(self, audio_data):
+        from vosk import KaldiRecognizer
+        recognizer = KaldiRecognizer(self.get_model(), self.sample_rate)
+        recognizer.AcceptWaveform(audio_data.get_raw_data(convert_rate=self.sample_rate, convert_width=2))
+        return json.loads(recognizer.FinalResult()).get('text', '')
+    
+    def transcribe(self, recognizer, audio_data):
+        text = self.timed(self.recognize, audio_data)
+        if not text.strip():
+            raise sr.UnknownValueError()
+        return text
+
+class WhisperSpeechToText(SpeechBackend):
+    """Offline Whisper recognition via faster-whisper (CTranslate2, int8 on CPU)"""
+    name = "whisper"
+    stage = "stt"
+    sample_rate = 16000
+    
+    def load_model(self):
+        from faster_whisper import WhisperModel
+        # A model name would be downloaded from the Hugging Face Hub; require a converted local model
+        if not self.model_id or not os.path.isdir(self.model_id):
+            raise ValueError(f"Whisper requires a local CTranslate2 model directory (WHISPER_MODEL), got: {self.model_id!r}")
+        return WhisperModel(self.model_id, device="cpu", compute_type="int8", local_files_only=True)
+    
+    def recognize(self, audio_data):
+        import numpy as np
+        raw = audio_data.get_raw_data(convert_rate=self.sample_rate, convert_width=2)
+        samples = np.frombuffer(raw, dtype=np.int16).astype(np.float32) / 32768.0
+        segments, _ = self.get_model().transcribe(samples, beam_size=1, language="en")
+        return " ".join(segment.text.strip() for segment in segments)
+    
+    def transcribe(self, recognizer, audio_data):
+        text = self.timed(self.recognize, audio_data)
+        if not text.strip():
+            raise sr.UnknownValueError()
+        return text
+
+class GoogleTextToSpeech(SpeechBackend):
+    """gTTS (network), MP3 output"""
+    name = "gtts"
+    stage = "tts"
+    audio_format = "audio/mp3"
+    
+    def render(self, text, lang):
+        buffer = io.BytesIO()
+        gTTS(text=text, lang=lang, slow=False).write_to_fp(buffer)
+        return buffer.getvalue()
+    
+    def synthesize(self, text, lang='en'):
+        return self.timed(self.render, text, lang)
+    
+    def join_segments(self, segments):
+        # MP3 frames can be concatenated into a single playable stream
+        return b"".join(segments)
+    
+    def duration(self, audio_bytes):
+        # gTTS writes constant 32 kbps MP3
+        return len(audio_bytes) * 8 / 32000
+
+class PiperTextToSpeech(SpeechBackend):
+    """Offline neural TTS with a local Piper voice model, WAV output"""
+    name = "piper"
+    stage = "tts"
+    audio_format = "audio/wav"
+    
+    def load_model(self):
+        from piper.voice import PiperVoice
+        if not self.model_id:
+            raise ValueError("Piper requires a voice model path (PIPER_MODEL_PATH)")
+        return PiperVoice.load(self.model_id)
+    
+    def render(self, text, lang):
+        buffer = io.BytesIO()
+        with wave.open(buffer, "wb") as wav_file:
+            self.get_model().synthesize(text, wav_file)
+        return buffer.getvalue()
+    
+    def synthesize(self, text, lang='en'):
+        return self.timed(self.render, text, lang)
+    
+    def join_segments(self, segments):
+        if not segments:
+            return b""
+        buffer = io.BytesIO()
+        with wave.open(buffer, "wb") as output:
+            for i, segment in enumerate(segments):
+                with wave.open(io.BytesIO(segment), "rb") as wav_file:
+                    if i == 0:
+                        output.setparams(wav_file.getparams())
+                    output.writeframes(wav_file.readframes(wav_file.getnframes()))
+        return buffer.getvalue()
+    
+    def duration(self, audio_bytes):
+        with wave.open(io.BytesIO(audio_bytes), "rb") as wav_file:
+            return wav_file.getnframes() / wav_file.getframerate()
+
+SPEECH_TO_TEXT_BACKENDS = {
+    "google": GoogleSpeechToText,
+    "vosk": VoskSpeechToText,
+    "whisper": WhisperSpeechToText,
+}
+
+TEXT_TO_SPEECH_BACKENDS = {
+    "gtts": GoogleTextToSpeech,
+    "piper": PiperTextToSpeech,
+}
 
 class VoiceInteraction:
-    def __init__(self):
+    # Synthesized audio shared across sessions, keyed by (tts engine, text hash, lang)
+    audio_cache = OrderedDict()
+    audio_cache_lock = threading.Lock()
+    max_cached_audio = 256
+    
+    def __init__(self, stt_backend="google", tts_backend="gtts", stt_model=None, tts_model=None):
         self.recognizer = sr.Recognizer()
         self.microphone = sr.Microphone()
+        self.calibrated = False
+        self.stt = SPEECH_TO_TEXT_BACKENDS[stt_backend](stt_model)
+        self.tts = TEXT_TO_SPEECH_BACKENDS[tts_backend](tts_model)
+        
+    def calibrate(self, source, duration=1.0):
+        """Adjust for ambient noise once per voice session"""
+        if not self.calibrated:
+            self.recognizer.adjust_for_ambient_noise(source, duration=duration)
+            self.calibrated = True
+    
+    def warm_up(self):
+        """Load local speech models ahead of the first question"""
+        self.stt.get_model()
+        self.tts.get_model()
+    
+    def transcribe(self, audio_data):
+        """Transcribe with the configured engine, raising speech_recognition errors"""
+        return self.stt.transcribe(self.recognizer, audio_data)
         
     def speech_to_text(self, audio_data):
         """Convert speech to text"""
         try:
-            # Use Google Speech Recognition
-            text = self.recognizer.recognize_google(audio_data)
-            return text
+            return self.transcribe(audio_data)
         except sr.UnknownValueError:
             return "Sorry, I couldn't understand the audio."
         except sr.RequestError as e:
             return f"Could not request results; {e}"
     
-    def text_to_speech(self, text, lang='en'):
-        """Convert text to speech and return as audio bytes"""
+    @staticmethod
+    def split_sentences(text, max_chars=250):
+        """Group sentences into segments short enough to synthesize quickly"""
+        sentences = re.split(r'(?<=[.!?])\s+', text.strip())
+        segment = ""
+        for sentence in sentences:
+            if segment and len(segment) + len(sentence) + 1 > max_chars:
+                yield segment
+                segment = ""
+            segment = f"{segment} {sentence}".strip()
+        if segment:
+            yield segment
+    
+    def synthesize(self, text, lang='en'):
+        """Synthesize a single segment in memory, using the shared audio cache"""
+        key = (self.tts.name, self.tts.model_id, hashlib.sha1(text.encode('utf-8')).hexdigest(), lang)
+        with self.audio_cache_lock:
+            if key in self.audio_cache:
+                self.audio_cache.move_to_end(key)
+                metrics.increment("tts_cache_hits")
+                return self.audio_cache[key]
+        
+        metrics.increment("tts_cache_misses")
+        audio_bytes = self.tts.synthesize(text, lang)
+        
+        with self.audio_cache_lock:
+            self.audio_cache[key] = audio_bytes
+            while len(self.audio_cache) > self.max_cached_audio:
+                self.audio_cache.popitem(last=False)
+        return audio_bytes
+    
+    def iter_speech(self, text, lang='en'):
+        """Yield audio sentence by sentence; each segment is cached on its own"""
         try:
-            tts = gTTS(text=text, lang=lang, slow=False)
-            
-            # Save to temporary file
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".mp3") as tmp_file:
-                tts.save(tmp_file.name)
-                
-                # Read the file and return bytes
-                with open(tmp_file.name, 'rb') as f:
-                    audio_bytes = f.read()
-                
-                # Clean up
-                os.unlink(tmp_file.name)
-                
-                return audio_bytes
+            for segment in self.split_sentences(text):
+                yield self.synthesize(segment, lang)
         except Exception as e:
             st.error(f"Text-to-speech error: {e}")
-            return None
+    
+    def text_to_speech(self, text, lang='en'):
+        """Convert text to speech and return as audio bytes"""
+        audio_bytes = self.tts.join_segments(list(self.iter_speech(text, lang)))
+        return audio_bytes or None
 
-class PersistentVectorStorage:
-    def __init__(self, persist_directory="./chroma_db"):
-        self.persist_directory = persist_directory
-        self.client = None
-        self.collection = None
-        self.encoder = None
-        
-    def initialize_storage(self):
-        """Initialize ChromaDB persistent storage"""
+def get_voice_session(stt_backend="google", tts_backend="gtts", stt_model=None, tts_model=None):
+    """Return the voice session for this user, recreating it when the engines change"""
+    voice = st.session_state.voice
+    config = (stt_backend, stt_model, tts_backend, tts_model)
+    if voice is None or (voice.stt.name, voice.stt.model_id, voice.tts.name, voice.tts.model_id) != config:
+        st.session_state.voice = VoiceInteraction(stt_backend, tts_backend, stt_model, tts_model)
         try:
-            # Create ChromaDB client with persistence
-            self.client = chromadb.PersistentClient(path=self.persist_directory)
-            
-            # Initialize sentence transformer
-            self.encoder = SentenceTransformer('all-MiniLM-L6-v2')
-            
-            st.success(f"✅ Persistent storage initialized at {self.persist_directory}")
-            return True
-            
+            with st.spinner("Loading speech models..."):
+                st.session_state.voice.warm_up()
         except Exception as e:
-            st.error(f"Error initializing storage: {e}")
-            return False
+            st.warning(f"Speech model warm-up failed: {e}")
+    return st.session_state.voice
+
+def play_speech(voice, text, autoplay=True):
+    """Autoplay the first sentence right away, then swap in one player for the whole answer"""
+    segments = voice.iter_speech(text)
+    first = next(segments, None)
+    if first is None:
+        return False
+    
+    placeholder = st.empty()
+    if autoplay:
+        placeholder.audio(first, format=voice.tts.audio_format, autoplay=True)
+    started = time.perf_counter()
+    
+    rest = list(segments)
+    if autoplay and not rest:
+        return True
+    audio_bytes = voice.tts.join_segments([first] + rest)
+    # Resume where the first sentence has got to (st.audio seeks in whole seconds)
+    start_time = int(min(time.perf_counter() - started, voice.tts.duration(first))) if autoplay else 0
+    placeholder.audio(audio_bytes, format=voice.tts.audio_format, autoplay=autoplay, start_time=start_time)
+    return True
+
+class QueryServiceClient:
+    """Storage stand-in that sends retrieval, generation and ingestion to query_service.py"""
+    def __init__(self, base_url, timeout=120):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.site_url = None
+    
+    @property
+    def collection(self):
+        """Truthy once a site is selected, like PersistentVectorStorage.collection"""
+        return self.site_url
     
-    def create_or_get_collection(self, collection_name="website_content"):
-        """Create or get existing collection"""
+    def request(self, method, path, payload=None):
+        response = self.session.request(method, f"{self.base_url}{path}", json=payload, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+    
+    def list_sites(self):
         try:
-            # Try to get existing collection first
-            try:
-                self.collection = self.client.get_collection(collection_name)
-                st.info(f"📚 Retrieved existing collection: {collection_name}")
-            except:
-                # Create new collection if doesn't exist
-                self.collection = self.client.create_collection(
-                    name=collection_name,
-                    metadata={"description": "Website content with OCR text"}
-                )
-                st.success(f"🆕 Created new collection: {collection_name}")
-            
-            return True
-        except Exception as e:
-            st.error(f"Error with collection: {e}")
-            return False
+            return self.request("GET", "/sites")
+        except requests.RequestException as e:
+            st.error(f"Query service unavailable at {self.base_url}: {e}")
+            return {}
+    
+    def use_site(self, website_url):
+        self.site_url = website_url
+        return True
+    
+    def metrics_snapshot(self):
+        try:
+            return self.request("GET", "/metrics.json")
+        except requests.RequestException:
+            return None
     
     def store_content(self, content_list, website_url):
-        """Store scraped content in ChromaDB"""
-        if not self.collection or not self.encoder:
-            return False
-        
+        """Have the service embed and index scraped pages"""
         try:
-            documents = []
-            metadatas = []
-            ids = []
-            
-            for i, item in enumerate(content_list):
-                # Create chunks for better search
-                content = item['content']
-                chunk_size = 800
-                words = content.split()
-                
-                for j, chunk_start in enumerate(range(0, len(words), chunk_size)):
-                    chunk = ' '.join(words[chunk_start:chunk_start + chunk_size])
-                    
-                    if len(chunk.strip()) > 100:
-                        doc_id = f"{website_url}_{i}_{j}_{int(time.time())}"
-                        
-                        documents.append(chunk)
-                        metadatas.append({
-                            'url': item['url'],
-                            'title': item['title'],
-                            'website': website_url,
-                            'chunk_index': j,
-                            'image_count': item.get('image_count', 0),
-                            'timestamp': time.time()
-                        })
-                        ids.append(doc_id)
-            
-            if documents:
-                # Store in ChromaDB
-                self.collection.add(
-                    documents=documents,
-                    metadatas=metadatas,
-                    ids=ids
-                )
-                
-                st.success(f"💾 Stored {len(documents)} content chunks in persistent database")
-                return True
-            
-        except Exception as e:
+            result = self.request("POST", "/ingest", {'website_url': website_url, 'content': content_list})
+        except requests.RequestException as e:
             st.error(f"Error storing content: {e}")
             return False
-    
-    def search_content(self, query, n_results=5):
-        """Search stored content"""
-        if not self.collection:
-            return []
         
+        self.site_url = website_url
+        if result.get('stored'):
+            st.success(f"💾 Stored {result['site']['chunks']} content chunks via the query service")
+        return result.get('stored', False)
+    
+    def search_content(self, query, n_results=5, website_url=None):
         try:
-            results = self.collection.query(
-                query_texts=[query],
-                n_results=n_results
-            )
-            
-            search_results = []
-            if results['documents']:
-                for i in range(len(results['documents'][0])):
-                    search_results.append({
-                        'content': results['documents'][0][i],
-                        'metadata': results['metadatas'][0][i],
-                        'distance': results['distances'][0][i] if results.get('distances') else 0
-                    })
-            
-            return search_results
-            
-        except Exception as e:
+            return self.request("POST", "/search", {
+                'query': query,
+                'site': website_url or self.site_url,
+                'n_results': n_results
+            })['results']
+        except requests.RequestException as e:
             st.error(f"Error searching content: {e}")
             return []
     
+    def ask(self, query, n_results=5):
+        """Return (sources, answer) from the service; answer is None without sources.
+        Raises requests.RequestException when the service fails, so it is not mistaken for an empty site."""
+        result = self.request("POST", "/ask", {'query': query, 'site': self.site_url, 'n_results': n_results})
+        return result['results'], result['answer']
+    
     def get_collection_stats(self):
-        """Get statistics about stored content"""
-        if not self.collection:
+        entry = self.list_sites().get(site_key(self.site_url)) if self.site_url else None
+        if not entry:
             return None
-        
-        try:
-            count = self.collection.count()
-            return {
-                'total_chunks': count,
-                'collection_name': self.collection.name
-            }
-        except Exception as e:
-            st.error(f"Error getting stats: {e}")
-            return None
-
-def generate_response_with_gemini(query, relevant_content, api_key):
-    """Generate response using Gemini AI"""
-    try:
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel('gemini-1.5-flash')
-        
-        # Prepare context from relevant content
-        context = ""
-        for i, item in enumerate(relevant_content):
-            metadata = item.get('metadata', {})
-            content = item.get('content', '')
-            context += f"\n\nSource {i+1} (from {metadata.get('title', 'Unknown')}):\n{content}"
-        
-        prompt = f"""Based on the following website content (including text extracted from images), please answer the user's question accurately and helpfully.
-
-Website Content:
-{context}
+        return {
+            'total_chunks': entry['chunks'],
+            'collection_name': entry['collection'],
+            'site': site_key(self.site_url)
+        }
 
-User Question: {query}
-
-Instructions:
-1. Answer based only on the provided website content
-2. If the information isn't available in the content, say so
-3. Include relevant source references when possible
-4. Be concise but comprehensive
-5. If you reference specific information, mention which source it came from
+def answer_question(storage, query, api_key, n_results=5):
+    """Retrieve sources and generate an answer, locally or through the query service.
+    Query service failures propagate as requests.RequestException."""
+    if isinstance(storage, QueryServiceClient):
+        return storage.ask(query, n_results)
+    
+    relevant_content = storage.search_content(query, n_results=n_results)
+    if not relevant_content:
+        return [], None
+    return relevant_content, generate_response_with_gemini(query, relevant_content, api_key)
 
-Answer:"""
-        
-        response = model.generate_content(prompt)
-        return response.text
-        
-    except Exception as e:
-        return f"Error generating response: {e}"
+def env_choice(name, choices, default):
+    """Index of an environment-configured option, falling back to the default when it is unknown"""
+    options = list(choices)
+    value = os.getenv(name, default)
+    if value not in options:
+        st.warning(f"Unknown {name} '{value}'; using '{default}'. Options: {', '.join(options)}")
+        value = default
+    return options.index(value)
 
 def autoplay_audio(audio_bytes):
     """Create HTML for autoplaying audio"""
@@ -567,23 +495,113 @@ def main():
         # Voice settings
         st.subheader("🎙️ Voice Settings")
         voice_enabled = st.checkbox("Enable voice responses", value=False)
+        stt_backend = st.selectbox("Speech recognition engine", list(SPEECH_TO_TEXT_BACKENDS),
+                                   index=env_choice("STT_BACKEND", SPEECH_TO_TEXT_BACKENDS, "google"),
+                                   help="vosk and whisper run fully offline from local model directories")
+        tts_backend = st.selectbox("Text-to-speech engine", list(TEXT_TO_SPEECH_BACKENDS),
+                                   index=env_choice("TTS_BACKEND", TEXT_TO_SPEECH_BACKENDS, "gtts"),
+                                   help="piper runs fully offline")
+        stt_models = {'vosk': os.getenv("VOSK_MODEL_PATH"), 'whisper': os.getenv("WHISPER_MODEL")}
+        voice_config = {
+            'stt_backend': stt_backend,
+            'tts_backend': tts_backend,
+            'stt_model': stt_models.get(stt_backend),
+            'tts_model': os.getenv("PIPER_MODEL_PATH") if tts_backend == "piper" else None
+        }
         
         # Storage settings
         st.subheader("💾 Storage Settings")
-        collection_name = st.text_input("Collection name", value="website_content")
+        collection_name = st.text_input("Collection prefix", value="website_content",
+                                        help="Each site is stored in its own collection named <prefix>-<site>")
+        vector_backend = st.selectbox("Vector backend for new sites", list(VECTOR_BACKENDS),
+                                      index=env_choice("VECTOR_BACKEND", VECTOR_BACKENDS, "chroma"),
+                                      help="numpy-* are in-process flat indexes for small sites; faiss-* need faiss-cpu")
+        query_service_url = st.text_input("Query service URL", value=os.getenv("QUERY_SERVICE_URL", ""),
+                                          help="Run query_service.py and enter its URL to share models across sessions")
+        
+        # Switch between the shared query service and in-session storage
+        if "storage" in st.session_state:
+            current = st.session_state.storage
+            uses_service = isinstance(current, QueryServiceClient)
+            if uses_service != bool(query_service_url) or (uses_service and current.base_url != query_service_url.rstrip('/')):
+                del st.session_state.storage
         
         # Initialize storage
-        if "storage" not in st.session_state:
-            st.session_state.storage = PersistentVectorStorage()
+        if "storage" not in st.session_state and query_service_url:
+            st.session_state.storage = QueryServiceClient(query_service_url)
+        elif "storage" not in st.session_state:
+            st.session_state.storage = PersistentVectorStorage(collection_prefix=collection_name, backend=vector_backend)
             if st.session_state.storage.initialize_storage():
-                st.session_state.storage.create_or_get_collection(collection_name)
+                # Split content stored before per-site collections into registered sites (runs once)
+                imported = st.session_state.storage.import_legacy_collection()
+                if imported:
+                    st.info(f"📦 Imported previously crawled sites: {', '.join(imported)}")
+                
+                # Apply the configured retention policy once per session
+                ttl_days = float(os.getenv("SITE_TTL_DAYS", "0"))
+                max_sites = int(os.getenv("MAX_SITES", "0"))
+                if ttl_days or max_sites:
+                    evicted = st.session_state.storage.evict_sites(ttl_days, max_sites)
+                    if evicted:
+                        st.info(f"🧹 Evicted stale sites: {', '.join(evicted)}")
+        storage = st.session_state.storage
+        local_storage = isinstance(storage, PersistentVectorStorage)
+        if local_storage:
+            storage.default_backend = vector_backend
+        
+        # Queries are scoped to one site at a time
+        sites = storage.list_sites()
+        if sites:
+            site_keys = sorted(sites)
+            last_site = site_key(st.session_state.last_url) if st.session_state.last_url else None
+            active_site = st.selectbox("Active site", site_keys,
+                                       index=site_keys.index(last_site) if last_site in site_keys else 0)
+            storage.use_site(sites[active_site]['url'])
         
         # Display storage stats
-        if st.session_state.storage and st.session_state.storage.collection:
-            stats = st.session_state.storage.get_collection_stats()
+        if storage and storage.collection:
+            stats = storage.get_collection_stats()
             if stats:
                 st.metric("Stored chunks", stats['total_chunks'])
         
+        # Site registry with retention controls
+        if sites and local_storage:
+            with st.expander("🗂️ Site registry"):
+                st.dataframe([
+                    {
+                        'site': key,
+                        'pages': entry['pages'],
+                        'chunks': entry['chunks'],
+                        'backend': entry.get('backend', 'chroma'),
+                        'size KB': round(entry['size_bytes'] / 1024, 1),
+                        'index KB': round(entry['index_bytes'] / 1024, 1) if entry.get('index_bytes') else None,
+                        'last crawl': time.strftime("%Y-%m-%d %H:%M", time.localtime(entry['last_crawl'])) if entry['last_crawl'] else "-"
+                    }
+                    for key, entry in sorted(sites.items())
+                ], use_container_width=True, hide_index=True)
+                
+                ttl_days = st.number_input("Evict sites not crawled for (days)", min_value=0, value=30)
+                max_sites = st.number_input("Keep at most (sites, 0 = unlimited)", min_value=0, value=0)
+                if st.button("🧹 Evict stale sites"):
+                    evicted = storage.evict_sites(ttl_days, max_sites)
+                    st.success(f"Evicted: {', '.join(evicted)}" if evicted else "Nothing to evict")
+                
+                # Compare per-backend query latency in the Performance panel before moving a site
+                site_to_move = st.selectbox("Move site", site_keys, key="site_to_move")
+                target_backend = st.selectbox("To backend", list(VECTOR_BACKENDS), key="target_backend")
+                if st.button("🔁 Move site"):
+                    try:
+                        with st.spinner(f"Moving {site_to_move} to {target_backend}..."):
+                            moved = storage.migrate_site(site_to_move, target_backend)
+                        st.success(f"Moved {site_to_move} to {target_backend}" if moved else "Site already uses that backend")
+                    except Exception as e:
+                        st.error(f"Error moving site: {e}")
+                
+                site_to_delete = st.selectbox("Delete site", site_keys, key="site_to_delete")
+                if st.button("🗑️ Delete site"):
+                    storage.delete_site(site_to_delete)
+                    st.success(f"Deleted {site_to_delete}")
+        
         # Scraping button
         if st.button("🚀 Start Advanced Scraping", disabled=not (website_url and gemini_api_key)):
             if website_url != st.session_state.last_url:
@@ -597,7 +615,16 @@ def main():
                     
                     # Parallel scraping with OCR
                     st.info(f"🔄 Scraping {len(urls)} pages with {max_workers} workers...")
-                    content = scraper.parallel_scrape_pages(urls, max_workers, extract_images)
+                    progress_bar = st.progress(0)
+                    status_text = st.empty()
+                    
+                    def show_progress(completed, total, url):
+                        status_text.text(f"Scraping page {completed}/{total}: {url}")
+                        progress_bar.progress(completed / total)
+                    
+                    content = scraper.parallel_scrape_pages(urls, max_workers, extract_images, on_progress=show_progress)
+                    progress_bar.empty()
+                    status_text.empty()
                     
                     if content:
                         st.session_state.website_content = content
@@ -646,15 +673,15 @@ def main():
             # Process voice input when button is clicked
             if st.session_state.listening_for_voice and st.session_state.storage:
                 try:
-                    # Initialize voice interaction
-                    voice = VoiceInteraction()
+                    # Reuse this session's recognizer and microphone
+                    voice = get_voice_session(**voice_config)
                     
                     # Show listening indicator
                     with st.spinner("🎤 Listening... Please speak your question now!"):
                         # Record audio with enhanced microphone setup
                         with voice.microphone as source:
-                            # Adjust for ambient noise
-                            voice.recognizer.adjust_for_ambient_noise(source, duration=1.0)
+                            # Adjust for ambient noise (first question of the session only)
+                            voice.calibrate(source)
                             
                             # Listen for speech with reasonable timeout
                             try:
@@ -666,19 +693,23 @@ def main():
                                 
                                 # Convert speech to text
                                 with st.spinner("🧠 Converting speech to text..."):
-                                    text_query = voice.recognizer.recognize_google(audio_data)
+                                    text_query = voice.transcribe(audio_data)
                                 
                                 if text_query and len(text_query.strip()) > 0:
                                     st.success(f"🎤 **You asked:** {text_query}")
                                     
                                     # Process the voice query exactly like a text query
                                     with st.spinner("🔍 Searching content and generating response..."):
-                                        # Search stored content
-                                        relevant_content = st.session_state.storage.search_content(text_query, n_results=5)
+                                        # Search stored content and generate response using Gemini
+                                        try:
+                                            relevant_content, response = answer_question(
+                                                st.session_state.storage, text_query, gemini_api_key
+                                            )
+                                        except requests.RequestException as e:
+                                            relevant_content, response = None, None
+                                            st.error(f"❌ Query service error: {e}")
                                         
                                         if relevant_content:
-                                            # Generate response using Gemini
-                                            response = generate_response_with_gemini(text_query, relevant_content, gemini_api_key)
                                             
                                             # Display the response
                                             st.write("🤖 **AI Response:**")
@@ -696,9 +727,7 @@ def main():
                                             
                                             # Generate and play voice response
                                             with st.spinner("🔊 Generating voice response..."):
-                                                audio_bytes = voice.text_to_speech(response)
-                                                if audio_bytes:
-                                                    st.audio(audio_bytes, format="audio/mp3", autoplay=False)
+                                                if play_speech(voice, response, autoplay=False):
                                                     st.success("🔊 Voice response generated! Click play above to hear it.")
                                             
                                             # Show sources used
@@ -713,7 +742,7 @@ def main():
                                                     )
                                                     st.write(item.get('content', '')[:300] + "...")
                                                     st.divider()
-                                        else:
+                                        elif relevant_content is not None:
                                             st.warning("❌ No relevant content found for your voice query. Make sure the website contains information related to your question.")
                                 else:
                                     st.error("❌ No speech detected or speech was unclear. Please try again.")
@@ -758,16 +787,75 @@ def main():
                     height=100
                 )
                 if st.button("🔊 Generate Speech") and test_text:
-                    voice = VoiceInteraction()
+                    voice = get_voice_session(**voice_config)
                     with st.spinner("Creating audio..."):
                         audio_bytes = voice.text_to_speech(test_text)
                         if audio_bytes:
-                            st.audio(audio_bytes, format="audio/mp3")
+                            st.audio(audio_bytes, format=voice.tts.audio_format)
                             st.success("✅ Audio generated successfully!")
                         else:
                             st.error("❌ Failed to generate audio")
             
+            # Speech engine latency
+            if st.session_state.voice:
+                with st.expander("⏱️ Speech engine latency"):
+                    for backend in (st.session_state.voice.stt, st.session_state.voice.tts):
+                        stats = backend.get_stats()
+                        if stats['calls']:
+                            st.caption(f"{backend.name}: {stats['calls']} calls | avg {stats['avg_ms']:.0f} ms | "
+                                       f"p95 {stats['p95_ms']:.0f} ms | last {stats['last_ms']:.0f} ms | errors {stats['errors']}")
+                        else:
+                            st.caption(f"{backend.name}: no calls yet")
+                        if backend.load_time is not None:
+                            st.caption(f"{backend.name}: model loaded in {backend.load_time:.1f} s")
+            
             st.divider()
+        # Per-stage latency and throughput
+        with st.expander("📈 Performance"):
+            snapshot = metrics.snapshot()
+            if isinstance(st.session_state.storage, QueryServiceClient):
+                # Retrieval and generation are measured inside the query service
+                service_snapshot = st.session_state.storage.metrics_snapshot()
+                if service_snapshot:
+                    st.caption("Chat stages measured by the query service")
+                    snapshot['stages'].update(service_snapshot['stages'])
+                    snapshot['counters'].update(service_snapshot['counters'])
+            if snapshot['stages']:
+                st.dataframe([
+                    {
+                        'stage': stage,
+                        'count': values['count'],
+                        'avg ms': round(values['avg_ms'], 1),
+                        'p50 ms': round(values['p50_ms'], 1),
+                        'p95 ms': round(values['p95_ms'], 1),
+                        'max ms': round(values['max_ms'], 1)
+                    }
+                    for stage, values in sorted(snapshot['stages'].items())
+                ], use_container_width=True, hide_index=True)
+                
+                counters = snapshot['counters']
+                crawl = snapshot['stages'].get('crawl')
+                if crawl and crawl['total_s']:
+                    st.caption(f"Crawl throughput: {counters.get('pages_scraped', 0) / crawl['total_s']:.2f} pages/s")
+                embedding = snapshot['stages'].get('embedding_batch')
+                if embedding and embedding['total_s']:
+                    st.caption(f"Embedding throughput: {counters.get('chunks_embedded', 0) / embedding['total_s']:.1f} chunks/s")
+                st.caption(" | ".join(f"{name}: {value}" for name, value in sorted(counters.items())))
+                if isinstance(st.session_state.storage, PersistentVectorStorage) and st.session_state.storage.embedding_cache:
+                    cache_stats = st.session_state.storage.embedding_cache.get_stats()
+                    st.caption(f"Embedding cache: {cache_stats['entries']} vectors, "
+                               f"{cache_stats['size_bytes'] / 1024 / 1024:.1f} MB")
+            else:
+                st.caption("No measurements yet")
+            
+            col1, col2 = st.columns(2)
+            with col1:
+                st.download_button("JSON", metrics.export_json(), file_name="metrics.json", mime="application/json")
+            with col2:
+                st.download_button("Prometheus", metrics.export_prometheus(), file_name="metrics.prom", mime="text/plain")
+            if st.button("Reset metrics"):
+                metrics.reset()
+        
         # Display scraped content info
         if st.session_state.website_content:
             st.success(f"📄 {len(st.session_state.website_content)} pages loaded")
@@ -789,7 +877,8 @@ def main():
     
     # Chat input
     if prompt := st.chat_input("Ask anything about the website content...", 
-                              disabled=not (st.session_state.storage and gemini_api_key)):
+                              disabled=not (st.session_state.storage and
+                                            (gemini_api_key or isinstance(st.session_state.storage, QueryServiceClient)))):
         
         # Add user message
         st.session_state.messages.append({"role": "user", "content": prompt})
@@ -800,20 +889,20 @@ def main():
         with st.chat_message("assistant"):
             with st.spinner("🔍 Searching stored content and generating response..."):
                 if st.session_state.storage and st.session_state.storage.collection:
-                    # Search stored content
-                    relevant_content = st.session_state.storage.search_content(prompt, n_results=5)
+                    # Search stored content and generate response
+                    try:
+                        relevant_content, response = answer_question(st.session_state.storage, prompt, gemini_api_key)
+                    except requests.RequestException as e:
+                        relevant_content, response = None, f"Query service error: {e}"
+                        st.error(f"❌ {response}")
+                        st.session_state.messages.append({"role": "assistant", "content": response})
                     
                     if relevant_content:
-                        # Generate response
-                        response = generate_response_with_gemini(prompt, relevant_content, gemini_api_key)
                         st.write(response)
                         
                         # Generate voice response if enabled
                         if voice_enabled:
-                            voice = VoiceInteraction()
-                            audio_bytes = voice.text_to_speech(response)
-                            if audio_bytes:
-                                st.audio(audio_bytes, format="audio/mp3", autoplay=True)
+                            play_speech(get_voice_session(**voice_config), response)
                         
                         # Show sources
                         with st.expander("📚 Sources used"):
@@ -827,7 +916,7 @@ def main():
                                 st.divider()
                         
                         st.session_state.messages.append({"role": "assistant", "content": response})
-                    else:
+                    elif relevant_content is not None:
                         error_msg = "No relevant content found for your query."
                         st.write(error_msg)
                         st.session_state.messages.append({"role": "assistant", "content": error_msg})
@@ -854,6 +943,14 @@ def main():
         4. Enable voice features for hands-free interaction
         5. Chat with your content - everything is stored permanently!
         """)
+    
+    # Optional metrics file for external scrapers (e.g. node_exporter textfile collector)
+    metrics_export_path = os.getenv("METRICS_EXPORT_PATH")
+    if metrics_export_path:
+        try:
+            metrics.export_to_file(metrics_export_path)
+        except OSError as e:
+            st.warning(f"Could not write metrics to {metrics_export_path}: {e}")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
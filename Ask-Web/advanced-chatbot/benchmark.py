@@ -0,0 +1,313 @@
+# Reproducible Benchmark Suite for the Advanced Website Chatbot
+# Serves a generated fixture website locally and measures crawl, OCR, embedding, query and QA latency
+
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import threading
+import time
+from functools import partial
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+from PIL import Image, ImageDraw
+
+from chatbot_pipeline import (
+    AdvancedWebsiteScraper,
+    MainContentExtractor,
+    PersistentVectorStorage,
+    PipelineMetrics,
+    VECTOR_BACKENDS,
+    build_prompt,
+    metrics,
+)
+
+WORDS = (
+    "account api billing cache cluster config crawler dashboard deploy document engine export feature "
+    "gateway index install invoice latency license metric model network node order pipeline plan "
+    "policy pricing query queue release report request schema search server service session storage "
+    "support team tenant token update upload user vector version webhook worker workflow"
+).split()
+
+def make_sentence(rng, length):
+    words = [rng.choice(WORDS) for _ in range(length)]
+    return " ".join(words).capitalize() + ", " + " ".join(rng.choice(WORDS) for _ in range(6)) + "."
+
+def make_image(path, text):
+    """Render text into a PNG large enough for OCR to read"""
+    image = Image.new("RGB", (len(text) * 7 + 20, 30), "white")
+    ImageDraw.Draw(image).text((10, 8), text, fill="black")
+    image = image.resize((image.width * 4, image.height * 4))
+    image.save(path)
+
+def generate_fixture_site(root, pages=20, sections=5, paragraphs=4, images_per_page=2, js_fraction=0.25, seed=42):
+    """Write a static fixture site and return the expected content of every page"""
+    rng = random.Random(seed)
+    os.makedirs(os.path.join(root, "img"), exist_ok=True)
+    nav = "".join(f'<li><a href="/page{i}.html">Page {i}</a></li>' for i in range(pages))
+    fixture = []
+
+    for i in range(pages):
+        title = f"Fixture Page {i}"
+        page_sections = []
+        for k in range(sections):
+            text = " ".join(make_sentence(rng, rng.randint(12, 24)) for _ in range(paragraphs))
+            page_sections.append({'heading': f"Section {i}.{k}", 'text': text})
+
+        images = []
+        for k in range(images_per_page):
+            image_text = f"INVOICE {i:03d}-{k} TOTAL {rng.randint(100, 999)} USD"
+            make_image(os.path.join(root, "img", f"page{i}_{k}.png"), image_text)
+            images.append({'path': os.path.join(root, "img", f"page{i}_{k}.png"), 'text': image_text})
+
+        is_js = rng.random() < js_fraction
+        article = "".join(
+            f"<h2>{section['heading']}</h2>" + "".join(f"<p>{p.strip()}.</p>" for p in section['text'].split(".") if p.strip())
+            for section in page_sections
+        )
+        if is_js:
+            # Content only exists after the browser runs the script
+            body = f'<article id="content"></article><script>document.getElementById("content").innerHTML = {json.dumps(article)};</script>'
+        else:
+            body = f"<article>{article}</article>"
+
+        image_tags = "".join(f'<img src="/img/page{i}_{k}.png" alt="">' for k in range(images_per_page))
+        html = (f"<html><head><title>{title}</title></head><body>"
+                f"<nav><ul>{nav}</ul></nav><main>{body}{image_tags}</main>"
+                f"<footer><a href='/'>Home</a> <a href='/page0.html'>Start</a></footer></body></html>")
+        with open(os.path.join(root, f"page{i}.html"), "w", encoding="utf-8") as f:
+            f.write(html)
+
+        fixture.append({
+            'path': f"/page{i}.html",
+            'title': title,
+            'html': html,
+            'is_js': is_js,
+            'sections': page_sections,
+            'images': images
+        })
+
+    with open(os.path.join(root, "index.html"), "w", encoding="utf-8") as f:
+        f.write(f"<html><head><title>Fixture Home</title></head><body><h1>Fixture Home</h1><ul>{nav}</ul></body></html>")
+
+    return fixture
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+def serve_directory(root):
+    """Serve the fixture site on a free localhost port in a background thread"""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), partial(QuietHandler, directory=root))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+def summarize(latencies):
+    """p50/p95/mean in milliseconds for a list of seconds"""
+    if not latencies:
+        return {}
+    ordered = sorted(latencies)
+    return {
+        'count': len(ordered),
+        'mean_ms': 1000 * sum(ordered) / len(ordered),
+        'p50_ms': 1000 * PipelineMetrics.percentile(ordered, 0.50),
+        'p95_ms': 1000 * PipelineMetrics.percentile(ordered, 0.95)
+    }
+
+def stub_llm(prompt, delay_ms=0):
+    """Deterministic stand-in for Gemini so QA latency excludes the network"""
+    if delay_ms:
+        time.sleep(delay_ms / 1000)
+    return prompt.split("Source 1", 1)[-1][:200]
+
+def bench_parse(fixture):
+    extractor = MainContentExtractor()
+    static_pages = [page for page in fixture if not page['is_js']]
+    total_bytes = sum(len(page['html']) for page in static_pages)
+    started = time.perf_counter()
+    for page in static_pages:
+        list(extractor.iter_sections(page['html'], title=page['title']))
+    elapsed = time.perf_counter() - started
+    return {
+        'pages': len(static_pages),
+        'parser': extractor.parser,
+        'pages_per_sec': len(static_pages) / elapsed if elapsed else 0.0,
+        'mb_per_sec': total_bytes / 1e6 / elapsed if elapsed else 0.0
+    }
+
+def bench_crawl(scraper, base_url, pages, workers):
+    started = time.perf_counter()
+    urls = scraper.intelligent_url_discovery(base_url + "/index.html", max_pages=pages + 1)
+    content = scraper.parallel_scrape_pages(urls, max_workers=workers, extract_images=False)
+    elapsed = time.perf_counter() - started
+    with_content = sum(1 for item in content if "Section" in item["content"])
+    return content, {
+        'urls': len(urls),
+        'pages_scraped': len(content),
+        'pages_with_content': with_content,
+        'seconds': elapsed,
+        'pages_per_sec': len(content) / elapsed if elapsed else 0.0
+    }
+
+def bench_ocr(scraper, fixture):
+    images = [image for page in fixture for image in page['images']]
+    recognized = 0
+    started = time.perf_counter()
+    for image in images:
+        with open(image['path'], "rb") as f:
+            text = scraper.ocr_image_bytes(f.read())
+        # The invoice number is the most OCR-stable token
+        if image['text'].split()[1] in text:
+            recognized += 1
+    elapsed = time.perf_counter() - started
+    return {
+        'images': len(images),
+        'images_per_sec': len(images) / elapsed if elapsed else 0.0,
+        'recognized_ratio': recognized / len(images) if images else 0.0
+    }
+
+def bench_storage(storage, content, base_url):
+    """Store the crawl and report encoder throughput and embedding cache reuse for this pass"""
+    before = metrics.snapshot()
+    started = time.perf_counter()
+    storage.store_content(content, base_url)
+    elapsed = time.perf_counter() - started
+    after = metrics.snapshot()
+    
+    def delta(section, name, field=None):
+        old, new = before[section].get(name, 0), after[section].get(name, 0)
+        if field:
+            old, new = (old or {}).get(field, 0), (new or {}).get(field, 0)
+        return new - old
+    
+    embedded = delta('counters', 'chunks_embedded')
+    embedding_time = delta('stages', 'embedding_batch', 'total_s')
+    return {
+        'chunks_encoded': embedded,
+        'cache_hits': delta('counters', 'embedding_cache_hits'),
+        'store_seconds': elapsed,
+        'index_bytes': storage.collection.memory_bytes(),
+        'embed_chunks_per_sec': embedded / embedding_time if embedding_time else 0.0
+    }
+
+def bench_queries(storage, fixture, queries, llm_delay_ms, seed=7):
+    rng = random.Random(seed)
+    sentences = [sentence.strip() for page in fixture for section in page['sections']
+                 for sentence in section['text'].split(".") if len(sentence.split()) > 6]
+    questions = [" ".join(rng.choice(sentences).split()[:8]) for _ in range(queries)]
+
+    query_latencies = []
+    qa_latencies = []
+    for question in questions:
+        started = time.perf_counter()
+        results = storage.search_content(question, n_results=5)
+        query_latencies.append(time.perf_counter() - started)
+        stub_llm(build_prompt(question, results), llm_delay_ms)
+        qa_latencies.append(time.perf_counter() - started)
+
+    return {'query': summarize(query_latencies), 'qa_end_to_end': summarize(qa_latencies)}
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except Exception:
+        return None
+
+def compare_results(current, baseline_path):
+    """Print the ratio of each numeric result against a previous run"""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+
+    def flatten(data, prefix=""):
+        for key, value in data.items():
+            if isinstance(value, dict):
+                yield from flatten(value, f"{prefix}{key}.")
+            elif isinstance(value, (int, float)) and not isinstance(value, bool):
+                yield f"{prefix}{key}", value
+
+    old = dict(flatten(baseline['results']))
+    print(f"\nComparison against {baseline.get('commit')} ({baseline_path}):")
+    for key, value in flatten(current['results']):
+        if old.get(key):
+            print(f"  {key:45s} {old[key]:12.2f} -> {value:12.2f}  ({value / old[key]:.2f}x)")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the chatbot pipeline against a local fixture site")
+    parser.add_argument("--pages", type=int, default=20, help="Number of fixture pages")
+    parser.add_argument("--sections", type=int, default=5, help="Sections per page")
+    parser.add_argument("--paragraphs", type=int, default=4, help="Paragraphs per section")
+    parser.add_argument("--images-per-page", type=int, default=2, help="Images with text per page")
+    parser.add_argument("--js-fraction", type=float, default=0.25, help="Share of pages rendered by JavaScript")
+    parser.add_argument("--workers", type=int, default=3, help="Parallel scraping workers")
+    parser.add_argument("--queries", type=int, default=50, help="Number of benchmark queries")
+    parser.add_argument("--llm-delay-ms", type=float, default=0, help="Simulated stub LLM latency")
+    parser.add_argument("--vector-backend", default="chroma", choices=list(VECTOR_BACKENDS), help="Vector index to benchmark")
+    parser.add_argument("--gpu-ocr", action="store_true", help="Use EasyOCR instead of Tesseract")
+    parser.add_argument("--skip-crawl", action="store_true", help="Skip the Chrome crawl and store fixture text directly")
+    parser.add_argument("--skip-ocr", action="store_true", help="Skip the OCR benchmark")
+    parser.add_argument("--seed", type=int, default=42, help="Fixture generation seed")
+    parser.add_argument("--output", default="benchmark_results.json", help="Where to write the JSON results")
+    parser.add_argument("--compare", help="Previous results JSON to compare against")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(name)s: %(message)s")
+
+    with tempfile.TemporaryDirectory(prefix="askweb-bench-") as workdir:
+        site_root = os.path.join(workdir, "site")
+        fixture = generate_fixture_site(site_root, args.pages, args.sections, args.paragraphs,
+                                        args.images_per_page, args.js_fraction, args.seed)
+        server, base_url = serve_directory(site_root)
+        metrics.reset()
+        results = {'parse': bench_parse(fixture)}
+
+        try:
+            scraper = None
+            if not (args.skip_crawl and args.skip_ocr):
+                scraper = AdvancedWebsiteScraper(use_gpu_ocr=args.gpu_ocr)
+
+            if args.skip_crawl:
+                content = [{
+                    'url': base_url + page['path'],
+                    'title': page['title'],
+                    'content': "\n\n".join(section['text'] for section in page['sections']),
+                    'sections': page['sections'],
+                    'image_count': 0
+                } for page in fixture]
+            else:
+                content, results['crawl'] = bench_crawl(scraper, base_url, args.pages, args.workers)
+
+            if not args.skip_ocr:
+                results['ocr'] = bench_ocr(scraper, fixture)
+
+            storage = PersistentVectorStorage(persist_directory=os.path.join(workdir, "chroma_db"),
+                                              backend=args.vector_backend)
+            if storage.initialize_storage():
+                results['embed'] = bench_storage(storage, content, base_url)
+                # A re-crawl of unchanged pages should be served from the embedding cache
+                results['embed_recrawl'] = bench_storage(storage, content, base_url)
+                results.update(bench_queries(storage, fixture, args.queries, args.llm_delay_ms))
+        finally:
+            server.shutdown()
+
+    report = {
+        'commit': git_commit(),
+        'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'config': vars(args),
+        'results': results,
+        'stages': metrics.snapshot()['stages']
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    print(json.dumps(results, indent=2))
+    print(f"\nResults written to {args.output}")
+    if args.compare:
+        compare_results(report, args.compare)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1593 @@
+# Crawl, Storage and Retrieval Pipeline for the Advanced Website Chatbot
+# Shared by the Streamlit app, the benchmark suite and the query service; importing it has no UI side effects
+
+import logging
+from selenium import webdriver
+from selenium.webdriver.common.by import By
+from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.webdriver.support import expected_conditions as EC
+from bs4 import BeautifulSoup, Comment
+import google.generativeai as genai
+from sentence_transformers import SentenceTransformer
+import numpy as np
+import requests
+from urllib.parse import urljoin, urlparse
+import time
+import re
+import shutil
+import unicodedata
+import uuid
+import os
+import io
+import hashlib
+import json
+import threading
+import weakref
+from contextlib import contextmanager
+from functools import wraps
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from collections import deque
+
+import chromadb
+import easyocr
+import pytesseract
+from PIL import Image
+
+class LogReporter:
+    """Sends user-facing pipeline messages to logging; the Streamlit app swaps in st"""
+    def __init__(self, logger):
+        self.logger = logger
+    
+    def error(self, message):
+        self.logger.error(message)
+    
+    def warning(self, message):
+        self.logger.warning(message)
+    
+    def info(self, message):
+        self.logger.info(message)
+    
+    def success(self, message):
+        self.logger.info(message)
+
+report = LogReporter(logging.getLogger(__name__))
+
+def set_reporter(reporter):
+    """Route messages to another object with error/warning/info/success, e.g. the streamlit module"""
+    global report
+    report = reporter
+
+class PipelineMetrics:
+    """Process-wide counters and latency histograms for the crawl and chat pipeline"""
+    # Histogram bucket upper bounds in seconds
+    BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+    
+    def __init__(self, max_samples=1000):
+        self.lock = threading.Lock()
+        self.max_samples = max_samples
+        self.reset()
+    
+    def reset(self):
+        with self.lock:
+            self.counters = {}
+            self.histograms = {}
+            self.started = time.time()
+    
+    def increment(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+    
+    def observe(self, stage, seconds):
+        with self.lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = {
+                    'count': 0,
+                    'sum': 0.0,
+                    'buckets': [0] * len(self.BUCKETS),
+                    'samples': deque(maxlen=self.max_samples)
+                }
+            histogram['count'] += 1
+            histogram['sum'] += seconds
+            histogram['samples'].append(seconds)
+            for i, bound in enumerate(self.BUCKETS):
+                if seconds <= bound:
+                    histogram['buckets'][i] += 1
+                    break
+    
+    @contextmanager
+    def timer(self, stage):
+        """Time a block and record it under the given stage"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - started)
+    
+    @staticmethod
+    def percentile(ordered, fraction):
+        return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+    
+    def snapshot(self):
+        """Summary of every counter and stage, safe to serialize as JSON"""
+        with self.lock:
+            stages = {}
+            for stage, histogram in self.histograms.items():
+                ordered = sorted(histogram['samples'])
+                stages[stage] = {
+                    'count': histogram['count'],
+                    'total_s': histogram['sum'],
+                    'avg_ms': 1000 * histogram['sum'] / histogram['count'],
+                    'p50_ms': 1000 * self.percentile(ordered, 0.50),
+                    'p95_ms': 1000 * self.percentile(ordered, 0.95),
+                    'max_ms': 1000 * ordered[-1]
+                }
+            return {
+                'uptime_s': time.time() - self.started,
+                'counters': dict(self.counters),
+                'stages': stages
+            }
+    
+    def export_json(self):
+        return json.dumps(self.snapshot(), indent=2)
+    
+    def export_prometheus(self, prefix="askweb"):
+        """Render metrics in the Prometheus text exposition format"""
+        lines = []
+        with self.lock:
+            for name, value in sorted(self.counters.items()):
+                lines.append(f"# TYPE {prefix}_{name}_total counter")
+                lines.append(f"{prefix}_{name}_total {value}")
+            
+            if self.histograms:
+                lines.append(f"# TYPE {prefix}_stage_seconds histogram")
+            for stage, histogram in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, count in zip(self.BUCKETS, histogram['buckets']):
+                    cumulative += count
+                    lines.append(f'{prefix}_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'{prefix}_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {histogram["count"]}')
+                lines.append(f'{prefix}_stage_seconds_sum{{stage="{stage}"}} {histogram["sum"]}')
+                lines.append(f'{prefix}_stage_seconds_count{{stage="{stage}"}} {histogram["count"]}')
+        return "\n".join(lines) + "\n"
+    
+    def export_to_file(self, path):
+        """Write metrics to disk; .prom files use the Prometheus textfile format, anything else JSON"""
+        content = self.export_prometheus() if path.endswith(".prom") else self.export_json()
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(content)
+
+# Single metrics registry shared by every session (and thread) in this process
+metrics = PipelineMetrics()
+
+class MainContentExtractor:
+    """Readability-style main content extraction that splits the page into sections"""
+    # Tags that never carry readable content
+    NON_CONTENT_TAGS = ["script", "style", "noscript", "template", "svg", "canvas", "iframe", "form", "button"]
+    # Containers considered as candidates for the main content block; table cells are scored per row
+    CANDIDATE_TAGS = ["article", "main", "section", "div", "tr"]
+    HEADING_TAGS = ["h1", "h2", "h3", "h4", "h5", "h6"]
+    TEXT_BLOCK_TAGS = ["p", "li", "pre", "blockquote", "dd", "dt", "figcaption", "td", "th"]
+    # Inline elements whose text counts as the parent's own text (div/span layouts of JS apps)
+    INLINE_TAGS = ["a", "span", "b", "strong", "em", "i", "u", "small", "code", "mark", "abbr", "label", "time", "sup", "sub"]
+
+    def __init__(self, max_link_density=0.5, min_block_chars=25, min_main_share=0.25,
+                 sibling_share=0.2, min_sibling_score=2):
+        self.max_link_density = max_link_density
+        self.min_block_chars = min_block_chars
+        self.min_main_share = min_main_share
+        self.sibling_share = sibling_share
+        self.min_sibling_score = min_sibling_score
+        self.parser = self.select_parser()
+
+    @staticmethod
+    def select_parser():
+        """Prefer the lxml parser and fall back to the pure-Python html.parser"""
+        try:
+            import lxml  # noqa: F401
+            return 'lxml'
+        except ImportError:
+            return 'html.parser'
+
+    def parse(self, html):
+        """Parse HTML and drop elements that never contain readable text"""
+        soup = BeautifulSoup(html, self.parser)
+        for element in soup(self.NON_CONTENT_TAGS):
+            element.decompose()
+        for comment in soup.find_all(string=lambda text: isinstance(text, Comment)):
+            comment.extract()
+        return soup
+
+    def link_density(self, node, text_length=None):
+        """Share of a node's text that sits inside links"""
+        if text_length is None:
+            text_length = len(node.get_text(" ", strip=True))
+        if not text_length:
+            return 1.0
+        link_length = sum(len(a.get_text(" ", strip=True)) for a in node.find_all("a"))
+        return min(link_length / text_length, 1.0)
+
+    def own_text(self, node):
+        """Text of a node's direct strings and inline children, outside any block element"""
+        parts = []
+        for child in node.children:
+            if child.name is None:
+                parts.append(str(child).strip())
+            elif child.name in self.INLINE_TAGS:
+                parts.append(child.get_text(" ", strip=True))
+        return ' '.join(part for part in parts if part)
+
+    def score_node(self, node):
+        """Score a candidate container by text density, penalising link-heavy blocks"""
+        blocks = [paragraph.get_text(" ", strip=True)
+                  for paragraph in node.find_all(self.TEXT_BLOCK_TAGS, recursive=False)]
+        blocks.append(self.own_text(node))
+
+        score = 0
+        for text in blocks:
+            if len(text) < self.min_block_chars:
+                continue
+            # Commas and length are cheap signals for prose
+            score += 1 + text.count(",") + min(len(text) // 100, 3)
+
+        if not score:
+            return 0
+        return score * (1 - self.link_density(node))
+
+    def content_length(self, node):
+        """Length of a node's text outside links"""
+        text_length = len(node.get_text(" ", strip=True))
+        return text_length * (1 - self.link_density(node, text_length)) if text_length else 0
+
+    def is_content_sibling(self, sibling, score, threshold):
+        """Readability's sibling rule: well-scored containers, or long low-link paragraphs"""
+        if score >= threshold:
+            return True
+        if sibling.name == "p":
+            text = sibling.get_text(" ", strip=True)
+            return len(text) > 80 and self.link_density(sibling, len(text)) < 0.25
+        return False
+
+    def find_main_nodes(self, soup):
+        """Pick the highest-scoring container plus its content siblings, in document order"""
+        scores = {}
+        for candidate in soup.find_all(self.CANDIDATE_TAGS):
+            score = self.score_node(candidate)
+            if not score:
+                continue
+            scores[id(candidate)] = (scores.get(id(candidate), (0, candidate))[0] + score, candidate)
+
+            # Parents inherit part of their children's score, as in readability
+            parent = candidate.parent
+            if parent is not None and parent.name not in (None, "[document]"):
+                scores[id(parent)] = (scores.get(id(parent), (0, parent))[0] + score / 2, parent)
+
+        body = soup.body or soup
+        if not scores:
+            return [body]
+
+        top_score, top_node = max(scores.values(), key=lambda item: item[0])
+        main_nodes = [top_node]
+        if top_node.parent is not None:
+            # Content split across sibling sections, columns or cards belongs together
+            threshold = max(self.min_sibling_score, self.sibling_share * top_score)
+            main_nodes = [
+                sibling for sibling in top_node.parent.find_all(recursive=False)
+                if sibling is top_node
+                or self.is_content_sibling(sibling, scores.get(id(sibling), (0, None))[0], threshold)
+            ]
+
+        # A winner holding little of the page's text is a banner or sidebar, not the content
+        if sum(self.content_length(node) for node in main_nodes) < self.min_main_share * self.content_length(body):
+            return [body]
+        return main_nodes
+
+    def is_boilerplate(self, node):
+        """Link-heavy blocks (menus, tag clouds, related links) are treated as boilerplate"""
+        text_length = len(node.get_text(" ", strip=True))
+        if not text_length:
+            return True
+        return self.link_density(node, text_length) > self.max_link_density
+
+    def iter_sections(self, html, title=None):
+        """Yield {'heading', 'text'} sections of the main content as they are walked"""
+        soup = self.parse(html)
+        main_nodes = self.find_main_nodes(soup)
+
+        heading = title
+        buffer = []
+
+        def walk(node):
+            nonlocal heading, buffer
+            for child in node.children:
+                if child.name is None:
+                    text = str(child).strip()
+                    if text:
+                        buffer.append(text)
+                    continue
+
+                if child.name in self.HEADING_TAGS:
+                    if buffer:
+                        yield self.make_section(heading, buffer)
+                        buffer = []
+                    heading = child.get_text(" ", strip=True) or heading
+                    continue
+
+                if child.name in self.CANDIDATE_TAGS + ["ul", "ol", "table", "nav", "aside", "footer", "header"]:
+                    if self.is_boilerplate(child):
+                        continue
+
+                if child.name in self.TEXT_BLOCK_TAGS and not child.find(self.HEADING_TAGS):
+                    text = child.get_text(" ", strip=True)
+                    if text:
+                        buffer.append(text)
+                    continue
+
+                yield from walk(child)
+
+        for main_node in main_nodes:
+            yield from walk(main_node)
+
+        if buffer:
+            yield self.make_section(heading, buffer)
+
+    @staticmethod
+    def make_section(heading, texts):
+        """Build a section dict with whitespace collapsed"""
+        return {'heading': heading, 'text': ' '.join(' '.join(texts).split())}
+
+class AdvancedWebsiteScraper:
+    def __init__(self, use_gpu_ocr=True):
+        self.setup_drivers()
+        self.setup_ocr(use_gpu_ocr)
+        self.extractor = MainContentExtractor()
+        
+    def setup_drivers(self):
+        """Setup multiple Chrome drivers for parallel scraping"""
+        self.drivers = []
+        self.max_drivers = 3  # Limit to prevent resource exhaustion
+        
+    def get_driver(self):
+        """Get or create a Chrome driver"""
+        chrome_options = Options()
+        chrome_options.add_argument("--headless")
+        chrome_options.add_argument("--no-sandbox")
+        chrome_options.add_argument("--disable-dev-shm-usage")
+        chrome_options.add_argument("--disable-gpu")
+        chrome_options.add_argument("--window-size=1920,1080")
+        chrome_options.add_argument("--disable-images")  # Skip images for faster loading
+        chrome_options.add_argument("--user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36")
+        
+        try:
+            with metrics.timer("driver_startup"):
+                driver = webdriver.Chrome(options=chrome_options)
+            driver.implicitly_wait(5)
+            return driver
+        except Exception as e:
+            report.error(f"Error setting up Chrome driver: {e}")
+            return None
+    
+    def setup_ocr(self, use_gpu=True):
+        """Setup OCR engines"""
+        self.use_gpu_ocr = use_gpu
+        try:
+            if use_gpu:
+                # EasyOCR - better for GPU
+                self.ocr_reader = easyocr.Reader(['en'])
+                report.success("✅ EasyOCR (GPU) initialized")
+            else:
+                # Tesseract - better for CPU
+                self.ocr_reader = None
+                report.success("✅ Tesseract (CPU) ready")
+        except Exception as e:
+            report.warning(f"OCR setup warning: {e}")
+            self.ocr_reader = None
+    
+    def ocr_image_bytes(self, image_bytes):
+        """Run OCR on raw image bytes with the configured engine"""
+        with metrics.timer("ocr_image"):
+            if self.use_gpu_ocr and self.ocr_reader:
+                # EasyOCR
+                results = self.ocr_reader.readtext(image_bytes)
+                text = " ".join([result[1] for result in results])
+            else:
+                # Tesseract
+                text = pytesseract.image_to_string(Image.open(io.BytesIO(image_bytes)))
+        metrics.increment("images_ocr")
+        return text
+    
+    def extract_text_from_images(self, driver):
+        """Extract text from images on the current page"""
+        extracted_texts = []
+        
+        try:
+            # Find all images on the page
+            images = driver.find_elements(By.TAG_NAME, "img")
+            
+            for i, img in enumerate(images[:5]):  # Limit to first 5 images
+                try:
+                    # Get image src
+                    img_src = img.get_attribute("src")
+                    if not img_src or img_src.startswith("data:"):
+                        continue
+                    
+                    # Download image
+                    response = requests.get(img_src, timeout=10)
+                    if response.status_code == 200:
+                        text = self.ocr_image_bytes(response.content)
+                        
+                        if text.strip():
+                            extracted_texts.append(f"Image {i+1}: {text.strip()}")
+                            
+                except Exception as e:
+                    continue
+                    
+        except Exception as e:
+            report.warning(f"Image OCR error: {e}")
+            
+        return extracted_texts
+    
+    def normalize_url(self, url):
+        """Normalize URL by removing fragments and normalizing case"""
+        parsed = urlparse(url)
+        normalized = f"{parsed.scheme}://{parsed.netloc.lower()}{parsed.path}"
+        if parsed.query:
+            normalized += f"?{parsed.query}"
+        return normalized.rstrip('/')
+    
+    def is_same_domain(self, url1, url2):
+        """Check if two URLs belong to the same domain"""
+        domain1 = urlparse(url1).netloc.lower().replace('www.', '')
+        domain2 = urlparse(url2).netloc.lower().replace('www.', '')
+        return domain1 == domain2
+    
+    def is_valid_url(self, url):
+        """Check if URL is valid for scraping"""
+        if not url:
+            return False
+        
+        parsed = urlparse(url)
+        if not parsed.scheme or not parsed.netloc:
+            return False
+            
+        # Skip certain file types
+        skip_extensions = ['.pdf', '.jpg', '.jpeg', '.png', '.gif', '.zip', '.doc', '.docx', '.mp4', '.avi']
+        if any(url.lower().endswith(ext) for ext in skip_extensions):
+            return False
+            
+        return True
+    
+    def scrape_single_page(self, url, extract_images=True):
+        """Scrape content from a single page with image OCR"""
+        driver = self.get_driver()
+        if not driver:
+            return None
+            
+        try:
+            with metrics.timer("page_load"):
+                driver.get(url)
+                time.sleep(2)
+                
+                # Wait for page to load
+                WebDriverWait(driver, 10).until(
+                    EC.presence_of_element_located((By.TAG_NAME, "body"))
+                )
+            
+            # Split the main content into density-scored sections
+            title = (driver.title or "No Title").strip()
+            with metrics.timer("parse"):
+                sections = list(self.extractor.iter_sections(driver.page_source, title=title))
+            
+            # Extract text from images if enabled
+            image_texts = []
+            if extract_images:
+                image_texts = self.extract_text_from_images(driver)
+            
+            # Combine regular content and image text
+            if image_texts:
+                sections.append({'heading': "Text from Images", 'text': "\n".join(image_texts)})
+            
+            full_content = "\n\n".join(
+                f"{section['heading']}\n{section['text']}" if section['heading'] else section['text']
+                for section in sections
+            )
+            
+            if len(full_content.strip()) > 100:
+                metrics.increment("pages_scraped")
+                return {
+                    'url': url,
+                    'title': title,
+                    'content': full_content,
+                    'sections': sections,
+                    'image_count': len(image_texts)
+                }
+                
+        except Exception as e:
+            metrics.increment("pages_failed")
+            report.warning(f"Error scraping {url}: {e}")
+        finally:
+            driver.quit()
+            
+        return None
+    
+    def parallel_scrape_pages(self, urls, max_workers=3, extract_images=True, on_progress=None):
+        """Scrape multiple pages in parallel, calling on_progress(completed, total, url) per page"""
+        scraped_content = []
+        
+        crawl_started = time.perf_counter()
+        
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # Submit scraping jobs
+            future_to_url = {
+                executor.submit(self.scrape_single_page, url, extract_images): url 
+                for url in urls
+            }
+            
+            completed = 0
+            total = len(urls)
+            
+            for future in as_completed(future_to_url):
+                completed += 1
+                url = future_to_url[future]
+                
+                if on_progress:
+                    on_progress(completed, total, url)
+                
+                try:
+                    result = future.result()
+                    if result:
+                        scraped_content.append(result)
+                except Exception as e:
+                    report.warning(f"Error scraping {url}: {e}")
+        
+        metrics.observe("crawl", time.perf_counter() - crawl_started)
+        
+        return scraped_content
+    
+    def intelligent_url_discovery(self, base_url, max_pages=20):
+        """Intelligent URL discovery with prioritization"""
+        discovered_urls = set()
+        priority_patterns = [
+            '/about', '/services', '/products', '/blog', '/news', '/faq', 
+            '/contact', '/help', '/docs', '/documentation', '/api'
+        ]
+        
+        driver = self.get_driver()
+        if not driver:
+            return [base_url]
+        
+        try:
+            driver.get(base_url)
+            time.sleep(2)
+            
+            # Get all links
+            links = driver.find_elements(By.TAG_NAME, "a")
+            base_domain = urlparse(base_url).netloc.lower().replace('www.', '')
+            
+            prioritized_urls = []
+            regular_urls = []
+            
+            for link in links:
+                try:
+                    href = link.get_attribute("href")
+                    if not href:
+                        continue
+                    
+                    absolute_url = urljoin(base_url, href)
+                    normalized_url = self.normalize_url(absolute_url)
+                    
+                    if (self.is_valid_url(absolute_url) and 
+                        self.is_same_domain(absolute_url, base_url) and
+                        normalized_url not in discovered_urls):
+                        
+                        discovered_urls.add(normalized_url)
+                        
+                        # Prioritize URLs with important patterns
+                        if any(pattern in normalized_url.lower() for pattern in priority_patterns):
+                            prioritized_urls.append(absolute_url)
+                        else:
+                            regular_urls.append(absolute_url)
+                            
+                except Exception:
+                    continue
+            
+            # Combine prioritized and regular URLs
+            all_urls = [base_url] + prioritized_urls + regular_urls
+            return all_urls[:max_pages]
+            
+        except Exception as e:
+            report.warning(f"Error discovering URLs: {e}")
+            return [base_url]
+        finally:
+            driver.quit()
+
+class ChromaIndex:
+    """Chroma collection behind the common vector index interface"""
+    def __init__(self, collection):
+        self.collection = collection
+        self.name = collection.name
+    
+    def count(self):
+        return self.collection.count()
+    
+    def add(self, ids, embeddings, documents, metadatas):
+        self.collection.add(ids=ids, embeddings=embeddings, documents=documents, metadatas=metadatas)
+    
+    def bulk_import(self, ids, embeddings, documents, metadatas, batch_size=1000):
+        for start in range(0, len(ids), batch_size):
+            end = start + batch_size
+            self.add(ids[start:end], embeddings[start:end], documents[start:end], metadatas[start:end])
+    
+    def delete_urls(self, urls):
+        if urls and self.count():
+            self.collection.delete(where={'url': {'$in': list(urls)}})
+    
+    def query(self, query_embedding, n_results):
+        results = self.collection.query(query_embeddings=[query_embedding], n_results=n_results)
+        if not results['documents']:
+            return []
+        return [
+            {
+                'content': results['documents'][0][i],
+                'metadata': results['metadatas'][0][i],
+                'distance': results['distances'][0][i] if results.get('distances') else 0
+            }
+            for i in range(len(results['documents'][0]))
+        ]
+    
+    def get_metadatas(self):
+        return self.collection.get(include=["metadatas"])['metadatas'] or []
+    
+    def export(self):
+        """Return (ids, embeddings, documents, metadatas) for migration"""
+        result = self.collection.get(include=["embeddings", "documents", "metadatas"])
+        return result['ids'], result['embeddings'], result['documents'], result['metadatas']
+    
+    def memory_bytes(self):
+        return None  # Managed by Chroma's SQLite/HNSW files
+
+class ChromaBackend:
+    name = "chroma"
+    
+    def __init__(self, persist_directory):
+        self.client = chromadb.PersistentClient(path=persist_directory)
+    
+    def open_collection(self, name):
+        """Return (index, created)"""
+        try:
+            return ChromaIndex(self.client.get_collection(name)), False
+        except Exception:
+            collection = self.client.create_collection(
+                name=name,
+                metadata={"description": "Website content with OCR text"}
+            )
+            return ChromaIndex(collection), True
+    
+    def delete_collection(self, name):
+        try:
+            self.client.delete_collection(name)
+        except ValueError:
+            pass  # Collection was already gone
+
+def synced(method):
+    """Run an index method under its lock, after reloading files rewritten elsewhere"""
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.lock:
+            self.sync()
+            return method(self, *args, **kwargs)
+    return wrapper
+
+class FlatIndex:
+    """In-process exact index: memory-mapped float16/int8 vectors plus a JSON record file"""
+    # Rows converted to float32 at a time while scoring, so queries never materialize the whole matrix
+    SEARCH_BLOCK_ROWS = 16384
+    
+    def __init__(self, directory, name, dtype="float16"):
+        self.directory = directory
+        self.name = name
+        self.dtype = dtype
+        self.lock = threading.RLock()
+        self.load()
+    
+    def path(self, filename):
+        return os.path.join(self.directory, filename)
+    
+    def files_stamp(self):
+        """Identify the current records file; it is replaced, never edited, on every write"""
+        try:
+            stat = os.stat(self.path("records.json"))
+            return stat.st_ino, stat.st_mtime_ns, stat.st_size
+        except OSError:
+            return None
+    
+    def sync(self):
+        """Reload if another process rewrote the index since it was loaded"""
+        if self.files_stamp() != self.stamp:
+            self.load()
+    
+    def generation_path(self, stem, extension, generation):
+        """Data files are versioned; records.json names the generation it was written with"""
+        return self.path(f"{stem}-{generation}.{extension}" if generation else f"{stem}.{extension}")
+    
+    def read_vectors(self, generation):
+        vectors = np.load(self.generation_path("vectors", "npy", generation), mmap_mode='r')
+        scales = np.load(self.generation_path("scales", "npy", generation)) if self.dtype == "int8" else None
+        return vectors, scales
+    
+    def load(self, attempts=5):
+        """Load records and the vectors of the same generation, retrying while another process swaps them"""
+        for _ in range(attempts):
+            stamp = self.files_stamp()
+            if stamp is None:
+                self.stamp, self.generation = None, None
+                self.ids, self.documents, self.metadatas = [], [], []
+                self.vectors, self.scales = None, None
+                return
+            
+            try:
+                with open(self.path("records.json"), encoding="utf-8") as f:
+                    records = json.load(f)
+                generation = records.get('generation')
+                vectors, scales = self.read_vectors(generation) if records['ids'] else (None, None)
+            except (OSError, ValueError):
+                time.sleep(0.05)  # Replaced or cleaned up mid-read
+                continue
+            
+            rows = len(records['ids'])
+            if vectors is None or (len(vectors) == rows and (scales is None or len(scales) == rows)):
+                self.stamp, self.generation = stamp, generation
+                self.ids, self.documents, self.metadatas = records['ids'], records['documents'], records['metadatas']
+                self.vectors, self.scales = vectors, scales
+                return
+            time.sleep(0.05)
+        
+        raise RuntimeError(f"Index {self.name}: vectors and records disagree after {attempts} attempts")
+    
+    def quantize(self, embeddings):
+        """Return (stored vectors, per-row scales) for float32 embeddings"""
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if self.dtype == "int8":
+            scales = np.abs(embeddings).max(axis=1) / 127.0
+            scales[scales == 0] = 1.0
+            return np.round(embeddings / scales[:, None]).astype(np.int8), scales.astype(np.float32)
+        return embeddings.astype(self.dtype), None
+    
+    def dequantized(self):
+        if self.vectors is None:
+            return np.zeros((0, 0), dtype=np.float32)
+        vectors = np.asarray(self.vectors, dtype=np.float32)
+        return vectors * self.scales[:, None] if self.scales is not None else vectors
+    
+    def write_vectors(self, generation, vectors, scales):
+        np.save(self.generation_path("vectors", "npy", generation), vectors)
+        if scales is not None:
+            np.save(self.generation_path("scales", "npy", generation), scales)
+    
+    def save(self, vectors, scales):
+        """Write a new generation of data files, then commit it by atomically replacing records.json"""
+        os.makedirs(self.directory, exist_ok=True)
+        generation = uuid.uuid4().hex[:16]
+        self.write_vectors(generation, vectors, scales)
+        with open(self.path("records.tmp.json"), "w", encoding="utf-8") as f:
+            json.dump({
+                'generation': generation,
+                'ids': self.ids,
+                'documents': self.documents,
+                'metadatas': self.metadatas
+            }, f)
+        os.replace(self.path("records.tmp.json"), self.path("records.json"))
+        
+        self.vectors = None  # Release the old memory map before its file is removed
+        self.load()
+        self.remove_stale_files(generation)
+    
+    def remove_stale_files(self, generation):
+        """Drop data files of older generations; readers still mapping one keep it until they reload"""
+        for filename in os.listdir(self.directory):
+            if re.fullmatch(r'(vectors|scales|index)(-[0-9a-f]+)?\.(npy|faiss)', filename) and generation not in filename:
+                try:
+                    os.remove(self.path(filename))
+                except OSError:
+                    pass  # Still mapped on Windows; removed by a later write
+    
+    @synced
+    def count(self):
+        return len(self.ids)
+    
+    @synced
+    def add(self, ids, embeddings, documents, metadatas):
+        vectors, scales = self.quantize(embeddings)
+        if self.vectors is not None:
+            vectors = np.concatenate([np.asarray(self.vectors), vectors])
+            if scales is not None:
+                scales = np.concatenate([self.scales, scales])
+        self.ids += list(ids)
+        self.documents += list(documents)
+        self.metadatas += list(metadatas)
+        self.save(vectors, scales)
+    
+    @synced
+    def bulk_import(self, ids, embeddings, documents, metadatas):
+        """Replace the contents with exported rows, writing (and building) once"""
+        self.ids, self.documents, self.metadatas = list(ids), list(documents), list(metadatas)
+        if not self.ids:
+            self.clear()
+            return
+        self.save(*self.quantize(embeddings))
+    
+    @synced
+    def delete_urls(self, urls):
+        urls = set(urls)
+        keep = [i for i, metadata in enumerate(self.metadatas) if metadata.get('url') not in urls]
+        if len(keep) == len(self.ids):
+            return
+        self.ids = [self.ids[i] for i in keep]
+        self.documents = [self.documents[i] for i in keep]
+        self.metadatas = [self.metadatas[i] for i in keep]
+        if not keep:
+            self.clear()
+            return
+        self.save(np.asarray(self.vectors)[keep], self.scales[keep] if self.scales is not None else None)
+    
+    @synced
+    def clear(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+        self.load()
+    
+    def search(self, query_vector, n_results):
+        """Return (row indices, cosine scores) of the best matches, scoring the memory map block by block"""
+        n_results = min(n_results, len(self.vectors))
+        best_rows = np.zeros(0, dtype=np.int64)
+        best_scores = np.zeros(0, dtype=np.float32)
+        for start in range(0, len(self.vectors), self.SEARCH_BLOCK_ROWS):
+            end = start + self.SEARCH_BLOCK_ROWS
+            scores = np.asarray(self.vectors[start:end], dtype=np.float32) @ query_vector
+            if self.scales is not None:
+                scores *= self.scales[start:end]
+            
+            # Merge this block's top-k into the running top-k
+            block_top = np.argpartition(-scores, min(n_results, len(scores)) - 1)[:n_results]
+            best_rows = np.concatenate([best_rows, block_top + start])
+            best_scores = np.concatenate([best_scores, scores[block_top]])
+            if len(best_rows) > n_results:
+                keep = np.argpartition(-best_scores, n_results - 1)[:n_results]
+                best_rows, best_scores = best_rows[keep], best_scores[keep]
+        
+        order = np.argsort(-best_scores)
+        return best_rows[order], best_scores[order]
+    
+    @synced
+    def query(self, query_embedding, n_results):
+        if not self.ids:
+            return []
+        rows, scores = self.search(np.asarray(query_embedding, dtype=np.float32), n_results)
+        # Squared L2 distance between unit vectors, matching Chroma's default space
+        return [
+            {
+                'content': self.documents[row],
+                'metadata': self.metadatas[row],
+                'distance': max(float(2 - 2 * score), 0.0)
+            }
+            for row, score in zip(rows, scores)
+        ]
+    
+    @synced
+    def get_metadatas(self):
+        return list(self.metadatas)
+    
+    @synced
+    def export(self):
+        return list(self.ids), self.dequantized().tolist(), list(self.documents), list(self.metadatas)
+    
+    @synced
+    def memory_bytes(self):
+        if self.vectors is None:
+            return 0
+        return self.vectors.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+class FaissIndex(FlatIndex):
+    """Approximate FAISS index: HNSW grown in place, or IVF with 8-bit scalar quantization rebuilt on writes"""
+    def __init__(self, directory, name, kind="hnsw"):
+        self.kind = kind
+        self.index = None
+        self.pending_index = None
+        super().__init__(directory, name, dtype="float32")
+    
+    def read_vectors(self, generation):
+        import faiss
+        vectors, scales = super().read_vectors(generation)
+        self.loaded_index = faiss.read_index(self.generation_path("index", "faiss", generation))
+        return vectors, scales
+    
+    def load(self, attempts=5):
+        self.loaded_index = None
+        super().load(attempts)
+        self.index = self.loaded_index if self.ids else None
+    
+    def build(self, vectors):
+        import faiss
+        dimension = vectors.shape[1]
+        if self.kind == "ivf":
+            nlist = max(1, min(int(4 * np.sqrt(len(vectors))), len(vectors) // 39 or 1))
+            quantizer = faiss.IndexFlatIP(dimension)
+            index = faiss.IndexIVFScalarQuantizer(quantizer, dimension, nlist,
+                                                  faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT)
+            index.train(vectors)
+            index.nprobe = min(8, nlist)
+        else:
+            index = faiss.IndexHNSWFlat(dimension, 32, faiss.METRIC_INNER_PRODUCT)
+            index.hnsw.efSearch = 64
+        index.add(vectors)
+        return index
+    
+    def save(self, vectors, scales, index=None):
+        """Write the given index, or build one from vectors, alongside the records"""
+        self.pending_index = index
+        super().save(np.ascontiguousarray(vectors, dtype=np.float32), scales)
+    
+    def write_vectors(self, generation, vectors, scales):
+        import faiss
+        super().write_vectors(generation, vectors, scales)
+        index = self.pending_index if self.pending_index is not None else self.build(vectors)
+        self.pending_index = None
+        faiss.write_index(index, self.generation_path("index", "faiss", generation))
+    
+    @synced
+    def add(self, ids, embeddings, documents, metadatas):
+        if self.kind != "hnsw" or self.index is None:
+            return super().add(ids, embeddings, documents, metadatas)
+        
+        # HNSW graphs accept new vectors without a rebuild
+        vectors = np.ascontiguousarray(embeddings, dtype=np.float32)
+        self.index.add(vectors)
+        self.ids += list(ids)
+        self.documents += list(documents)
+        self.metadatas += list(metadatas)
+        self.save(np.concatenate([np.asarray(self.vectors), vectors]), None, self.index)
+    
+    def search(self, query_vector, n_results):
+        scores, rows = self.index.search(query_vector.reshape(1, -1), min(n_results, len(self.ids)))
+        found = rows[0] >= 0
+        return rows[0][found], scores[0][found]
+    
+    @synced
+    def memory_bytes(self):
+        return os.path.getsize(self.generation_path("index", "faiss", self.generation)) if self.index is not None else 0
+
+class FileVectorBackend:
+    """Directory of in-process indexes, one subdirectory per collection"""
+    # Sessions share one index object per directory, so writes never overwrite each other
+    indexes = {}
+    indexes_guard = threading.Lock()
+    
+    def __init__(self, persist_directory, name, factory):
+        self.name = name
+        self.root = os.path.join(persist_directory, name)
+        self.factory = factory
+    
+    def open_collection(self, name):
+        directory = os.path.abspath(os.path.join(self.root, name))
+        with self.indexes_guard:
+            created = not os.path.exists(directory)
+            if directory not in self.indexes:
+                self.indexes[directory] = self.factory(directory, name)
+            return self.indexes[directory], created
+    
+    def delete_collection(self, name):
+        directory = os.path.abspath(os.path.join(self.root, name))
+        with self.indexes_guard:
+            index = self.indexes.get(directory)
+        if index:
+            index.clear()
+        else:
+            shutil.rmtree(directory, ignore_errors=True)
+
+VECTOR_BACKENDS = {
+    "chroma": lambda persist_directory: ChromaBackend(persist_directory),
+    "numpy-float16": lambda persist_directory: FileVectorBackend(
+        persist_directory, "numpy-float16", lambda directory, name: FlatIndex(directory, name, "float16")),
+    "numpy-int8": lambda persist_directory: FileVectorBackend(
+        persist_directory, "numpy-int8", lambda directory, name: FlatIndex(directory, name, "int8")),
+    "faiss-hnsw": lambda persist_directory: FileVectorBackend(
+        persist_directory, "faiss-hnsw", lambda directory, name: FaissIndex(directory, name, "hnsw")),
+    "faiss-ivf": lambda persist_directory: FileVectorBackend(
+        persist_directory, "faiss-ivf", lambda directory, name: FaissIndex(directory, name, "ivf")),
+}
+
+def site_key(url):
+    """Identify a site by its host, ignoring scheme, case and a leading www."""
+    netloc = urlparse(url).netloc.lower()
+    if netloc.startswith('www.'):
+        netloc = netloc[4:]
+    return netloc or url.strip().lower()
+
+def site_collection_name(prefix, key):
+    """Per-site Chroma collection name (3-63 chars of [a-z0-9_-], alphanumeric at both ends)"""
+    slug = re.sub(r'[^a-z0-9]+', '-', key.lower()).strip('-')
+    name = f"{prefix}-{slug}".strip('-_')
+    if len(name) > 63:
+        name = f"{name[:54].rstrip('-_')}-{hashlib.sha1(key.encode('utf-8')).hexdigest()[:8]}"
+    return name
+
+class SiteRegistry:
+    """JSON registry of crawled sites next to the Chroma database"""
+    # Sessions each hold their own registry object, so writes are serialized per process
+    lock = threading.Lock()
+    
+    def __init__(self, path):
+        self.path = path
+    
+    def load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+    
+    def save(self, sites):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(sites, f, indent=2)
+        os.replace(tmp_path, self.path)
+    
+    def get(self, key):
+        return self.load().get(key)
+    
+    def list_sites(self):
+        return self.load()
+    
+    def update(self, key, **fields):
+        """Read-modify-write a site entry"""
+        with self.lock:
+            sites = self.load()
+            entry = sites.setdefault(key, {
+                'url': None,
+                'collection': None,
+                'pages': 0,
+                'chunks': 0,
+                'size_bytes': 0,
+                'last_crawl': None,
+                'last_query': None
+            })
+            entry.update(fields)
+            self.save(sites)
+            return entry
+    
+    def record_queries(self, last_queries):
+        """Write buffered last_query times in one pass, skipping sites removed meanwhile"""
+        with self.lock:
+            sites = self.load()
+            for key, timestamp in last_queries.items():
+                if key in sites:
+                    sites[key]['last_query'] = max(sites[key].get('last_query') or 0, timestamp)
+            self.save(sites)
+    
+    def remove(self, key):
+        with self.lock:
+            sites = self.load()
+            entry = sites.pop(key, None)
+            self.save(sites)
+            return entry
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+@contextmanager
+def interprocess_lock(path):
+    """Exclusive lock on a lock file, held across every process sharing the directory"""
+    with open(path, "a+b") as f:
+        if fcntl:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+class EmbeddingCache:
+    """Append-only embedding cache: fixed-size (chunk hash, float16 vector) records in one memory-mapped file"""
+    # Sessions and the query service share the cache files, so appends are serialized per directory:
+    # a thread lock within the process and a file lock across processes
+    locks = {}
+    locks_guard = threading.Lock()
+    
+    def __init__(self, cache_directory, model_name):
+        slug = re.sub(r'[^A-Za-z0-9_.-]+', '-', model_name)
+        self.directory = os.path.join(cache_directory, slug)
+        self.model_name = model_name
+        self.records_path = os.path.join(self.directory, "records.bin")
+        self.dimension = None
+        self.record_dtype = None
+        self.rows = {}
+        self.loaded = 0
+        self.records = None
+        with self.locks_guard:
+            self.lock = self.locks.setdefault(self.directory, threading.Lock())
+        os.makedirs(self.directory, exist_ok=True)
+        self.refresh()
+    
+    @staticmethod
+    def chunk_hash(text):
+        """SHA-1 digest of the chunk with Unicode and whitespace normalized"""
+        normalized = ' '.join(unicodedata.normalize('NFC', text).split())
+        return hashlib.sha1(normalized.encode('utf-8')).digest()
+    
+    def set_dimension(self, dimension):
+        self.dimension = dimension
+        self.record_dtype = np.dtype([('hash', np.uint8, (20,)), ('vector', '<f2', (dimension,))])
+    
+    def complete_records(self):
+        """Number of whole records on disk; a torn trailing record is ignored"""
+        if not os.path.exists(self.records_path):
+            return 0
+        return os.path.getsize(self.records_path) // self.record_dtype.itemsize
+    
+    def refresh(self):
+        """Pick up records appended by other sessions since the last read"""
+        meta_path = os.path.join(self.directory, "meta.json")
+        if self.dimension is None and os.path.exists(meta_path):
+            with open(meta_path, encoding="utf-8") as f:
+                self.set_dimension(json.load(f)['dimension'])
+        if self.dimension is None:
+            return
+        
+        count = self.complete_records()
+        if count == self.loaded:
+            return
+        
+        self.records = np.memmap(self.records_path, dtype=self.record_dtype, mode='r', shape=(count,))
+        # Rows are record positions, so duplicate digests keep the first record and never shift later ones
+        for row in range(self.loaded, count):
+            self.rows.setdefault(self.records[row]['hash'].tobytes(), row)
+        self.loaded = count
+    
+    def get_many(self, texts):
+        """Return cached float32 embeddings, with None for misses"""
+        self.refresh()
+        results = []
+        for text in texts:
+            row = self.rows.get(self.chunk_hash(text))
+            results.append(None if row is None else np.asarray(self.records[row]['vector'], dtype=np.float32).tolist())
+        return results
+    
+    def put_many(self, texts, embeddings):
+        """Append embeddings for texts that are not cached yet"""
+        if not texts:
+            return
+        embeddings = np.asarray(embeddings, dtype=np.float16)
+        with self.lock, interprocess_lock(os.path.join(self.directory, "records.lock")):
+            self.refresh()
+            if self.dimension is None:
+                self.set_dimension(embeddings.shape[1])
+                with open(os.path.join(self.directory, "meta.json"), "w", encoding="utf-8") as f:
+                    json.dump({'model': self.model_name, 'dimension': self.dimension}, f)
+            
+            new_records = []
+            seen = set()
+            for text, vector in zip(texts, embeddings):
+                digest = self.chunk_hash(text)
+                if digest not in self.rows and digest not in seen:
+                    seen.add(digest)
+                    new_records.append((np.frombuffer(digest, dtype=np.uint8), vector))
+            if not new_records:
+                return
+            
+            # Hash and vector share one record; a partial record left by a crash is cut off before appending
+            with open(self.records_path, "ab") as f:
+                f.truncate(self.complete_records() * self.record_dtype.itemsize)
+                f.write(np.array(new_records, dtype=self.record_dtype).tobytes())
+            self.refresh()
+    
+    def get_stats(self):
+        return {
+            'entries': len(self.rows),
+            'size_bytes': self.loaded * (self.record_dtype.itemsize if self.record_dtype else 0)
+        }
+
+class PersistentVectorStorage:
+    # Sessions starting together must not import the legacy collection twice
+    legacy_import_lock = threading.Lock()
+    
+    def __init__(self, persist_directory="./chroma_db", collection_prefix="website_content", backend="chroma",
+                 model_name="all-MiniLM-L6-v2", query_flush_interval=30):
+        self.persist_directory = persist_directory
+        self.model_name = model_name
+        self.collection_prefix = collection_prefix
+        self.default_backend = backend
+        self.backends = {}
+        self.client = None
+        self.collection = None
+        self.encoder = None
+        self.embedding_cache = None
+        self.site = None
+        self.site_backend = backend
+        self.registry = SiteRegistry(os.path.join(persist_directory, "site_registry.json"))
+        # last_query times are buffered so a query never rewrites the whole registry;
+        # they are flushed on store, on eviction, every query_flush_interval seconds and when the session ends
+        self.last_queries = {}
+        self.last_flush = time.time()
+        self.query_flush_interval = query_flush_interval
+        weakref.finalize(self, self.write_queries, self.registry, self.last_queries)
+        
+    @staticmethod
+    def write_queries(registry, last_queries):
+        if last_queries:
+            pending = dict(last_queries)
+            last_queries.clear()
+            registry.record_queries(pending)
+    
+    def flush_last_queries(self):
+        self.write_queries(self.registry, self.last_queries)
+        self.last_flush = time.time()
+    
+    def get_backend(self, name):
+        """Open a vector backend once per storage instance"""
+        if name not in self.backends:
+            self.backends[name] = VECTOR_BACKENDS[name](self.persist_directory)
+        return self.backends[name]
+        
+    def initialize_storage(self):
+        """Initialize persistent vector storage"""
+        try:
+            # Open the default backend for new sites
+            self.client = self.get_backend(self.default_backend)
+            
+            # Initialize sentence transformer
+            self.encoder = SentenceTransformer(self.model_name)
+            self.embedding_cache = EmbeddingCache(os.path.join(self.persist_directory, "embedding_cache"), self.model_name)
+            
+            report.success(f"✅ Persistent storage initialized at {self.persist_directory}")
+            return True
+            
+        except Exception as e:
+            report.error(f"Error initializing storage: {e}")
+            return False
+    
+    def create_or_get_collection(self, collection_name="website_content", backend=None):
+        """Create or get existing collection"""
+        try:
+            self.collection, created = self.get_backend(backend or self.default_backend).open_collection(collection_name)
+            if created:
+                report.success(f"🆕 Created new collection: {collection_name}")
+            else:
+                report.info(f"📚 Retrieved existing collection: {collection_name}")
+            
+            return True
+        except Exception as e:
+            report.error(f"Error with collection: {e}")
+            return False
+    
+    def list_sites(self):
+        """Registered sites, or none before storage is initialized"""
+        return self.registry.list_sites() if self.client else {}
+    
+    def use_site(self, website_url):
+        """Scope storage and search to the collection of one site"""
+        key = site_key(website_url)
+        if self.site == key and self.collection:
+            return True
+        
+        entry = self.registry.get(key)
+        collection_name = entry['collection'] if entry else site_collection_name(self.collection_prefix, key)
+        backend = entry.get('backend', 'chroma') if entry else self.default_backend
+        if not self.create_or_get_collection(collection_name, backend):
+            return False
+        
+        self.site = key
+        self.site_backend = backend
+        if not entry:
+            self.registry.update(key, url=website_url, collection=collection_name, backend=backend)
+        return True
+    
+    def refresh_site_stats(self):
+        """Recount pages, chunks and stored text size for the active site"""
+        metadatas = self.collection.get_metadatas()
+        return self.registry.update(
+            self.site,
+            pages=len({metadata.get('url') for metadata in metadatas}),
+            chunks=len(metadatas),
+            size_bytes=sum(metadata.get('chars', 0) for metadata in metadatas),
+            index_bytes=self.collection.memory_bytes()
+        )
+    
+    def migrate_site(self, key, backend):
+        """Export a site's vectors from its current backend and import them into another"""
+        entry = self.registry.get(key)
+        source_backend = entry.get('backend', 'chroma')
+        if source_backend == backend:
+            return False
+        
+        source, _ = self.get_backend(source_backend).open_collection(entry['collection'])
+        ids, embeddings, documents, metadatas = source.export()
+        
+        target_backend = self.get_backend(backend)
+        target_backend.delete_collection(entry['collection'])
+        target, _ = target_backend.open_collection(entry['collection'])
+        target.bulk_import(ids, embeddings, documents, metadatas)
+        
+        self.registry.update(key, backend=backend, index_bytes=target.memory_bytes())
+        self.get_backend(source_backend).delete_collection(entry['collection'])
+        if self.site == key:
+            self.site = None
+            self.use_site(entry['url'])
+        return True
+    
+    def import_legacy_collection(self, collection_name=None):
+        """One-time split of the pre-registry single collection into registered per-site collections.
+        Returns the imported site keys; the legacy collection itself is left in place."""
+        collection_name = collection_name or self.collection_prefix
+        marker_path = os.path.join(self.persist_directory, f"legacy_import_{collection_name}.json")
+        with self.legacy_import_lock:
+            if os.path.exists(marker_path):
+                return []
+            try:
+                legacy = self.get_backend("chroma").client.get_collection(collection_name)
+            except Exception:
+                return []  # Nothing stored before per-site collections
+            
+            result = legacy.get(include=["embeddings", "documents", "metadatas"])
+            groups = {}
+            for i, metadata in enumerate(result['metadatas'] or []):
+                website = (metadata or {}).get('website') or (metadata or {}).get('url')
+                if website:
+                    groups.setdefault(site_key(website), (website, []))[1].append(i)
+            
+            imported = []
+            sites = self.registry.list_sites()
+            for key, (website, rows) in groups.items():
+                if key in sites:
+                    continue  # Re-crawled since the upgrade; the per-site collection is newer
+                name = site_collection_name(self.collection_prefix, key)
+                index, _ = self.get_backend(self.default_backend).open_collection(name)
+                documents = [result['documents'][i] for i in rows]
+                metadatas = [result['metadatas'][i] for i in rows]
+                index.bulk_import([result['ids'][i] for i in rows], [list(result['embeddings'][i]) for i in rows],
+                                  documents, metadatas)
+                self.registry.update(
+                    key,
+                    url=website,
+                    collection=name,
+                    backend=self.default_backend,
+                    pages=len({metadata.get('url') for metadata in metadatas}),
+                    chunks=len(rows),
+                    size_bytes=sum(len(document or '') for document in documents),
+                    index_bytes=index.memory_bytes(),
+                    last_crawl=max((metadata.get('timestamp') or 0 for metadata in metadatas), default=0) or time.time()
+                )
+                imported.append(key)
+            
+            with open(marker_path, "w", encoding="utf-8") as f:
+                json.dump({'imported': imported, 'timestamp': time.time()}, f)
+            return imported
+    
+    def delete_site(self, key):
+        """Drop a site's collection and registry entry"""
+        entry = self.registry.remove(key)
+        if entry and entry.get('collection'):
+            self.get_backend(entry.get('backend', 'chroma')).delete_collection(entry['collection'])
+        if self.site == key:
+            self.site = None
+            self.collection = None
+        return entry
+    
+    def evict_sites(self, ttl_days=None, max_sites=None):
+        """Evict sites not crawled within ttl_days, then least recently used sites beyond max_sites"""
+        self.flush_last_queries()
+        sites = self.registry.list_sites()
+        evicted = []
+        
+        if ttl_days:
+            cutoff = time.time() - ttl_days * 86400
+            for key, entry in sites.items():
+                if (entry.get('last_crawl') or 0) < cutoff:
+                    evicted.append(key)
+        
+        if max_sites:
+            remaining = [key for key in sites if key not in evicted]
+            remaining.sort(key=lambda key: max(sites[key].get('last_crawl') or 0, sites[key].get('last_query') or 0))
+            evicted.extend(remaining[:max(len(remaining) - max_sites, 0)])
+        
+        for key in evicted:
+            self.delete_site(key)
+        return evicted
+    
+    def iter_chunks(self, item, chunk_size=800):
+        """Yield (heading, chunk) pairs of at most chunk_size words, packing small sections together"""
+        sections = item.get('sections') or [{'heading': None, 'text': item['content']}]
+        heading = None
+        words = []
+        
+        for section in sections:
+            section_words = section['text'].split()
+            if section.get('heading'):
+                section_words = [f"{section['heading']}:"] + section_words
+            
+            # Prefer to start a new chunk on a section boundary
+            if words and len(words) + len(section_words) > chunk_size:
+                yield heading, ' '.join(words)
+                words = []
+            
+            if not words:
+                heading = section.get('heading')
+            words.extend(section_words)
+            
+            while len(words) >= chunk_size:
+                yield heading, ' '.join(words[:chunk_size])
+                words = words[chunk_size:]
+                heading = section.get('heading')
+        
+        if words:
+            yield heading, ' '.join(words)
+    
+    def embed_documents(self, documents, batch_size=64):
+        """Encode chunks in batches, skipping the encoder for chunks already in the embedding cache"""
+        embeddings = self.embedding_cache.get_many(documents) if self.embedding_cache else [None] * len(documents)
+        
+        # Encode each distinct uncached text once, even if it repeats across pages
+        missing = {}
+        for i, embedding in enumerate(embeddings):
+            if embedding is None:
+                missing.setdefault(documents[i], []).append(i)
+        metrics.increment("embedding_cache_hits", len(documents) - sum(len(rows) for rows in missing.values()))
+        metrics.increment("embedding_cache_misses", len(missing))
+        
+        texts = list(missing)
+        for start in range(0, len(texts), batch_size):
+            batch = texts[start:start + batch_size]
+            with metrics.timer("embedding_batch"):
+                vectors = self.encoder.encode(batch, batch_size=batch_size, normalize_embeddings=True)
+            metrics.increment("chunks_embedded", len(batch))
+            
+            if self.embedding_cache:
+                self.embedding_cache.put_many(batch, vectors)
+            for text, vector in zip(batch, vectors.tolist()):
+                for i in missing[text]:
+                    embeddings[i] = vector
+        return embeddings
+    
+    def store_content(self, content_list, website_url):
+        """Store scraped content in the site's ChromaDB collection, replacing re-crawled pages"""
+        if not self.encoder or not self.use_site(website_url):
+            return False
+        self.flush_last_queries()
+        
+        try:
+            # Re-crawled pages replace their previous chunks
+            self.collection.delete_urls({item['url'] for item in content_list})
+            
+            documents = []
+            metadatas = []
+            ids = []
+            
+            chunking_started = time.perf_counter()
+            for i, item in enumerate(content_list):
+                # Create chunks for better search, following page sections
+                for j, (heading, chunk) in enumerate(self.iter_chunks(item)):
+                    if len(chunk.strip()) > 100:
+                        doc_id = f"{website_url}_{i}_{j}_{int(time.time())}"
+                        
+                        documents.append(chunk)
+                        metadatas.append({
+                            'url': item['url'],
+                            'title': item['title'],
+                            'section': heading or item['title'],
+                            'website': website_url,
+                            'chunk_index': j,
+                            'chars': len(chunk),
+                            'image_count': item.get('image_count', 0),
+                            'timestamp': time.time()
+                        })
+                        ids.append(doc_id)
+            
+            metrics.observe("chunking", time.perf_counter() - chunking_started)
+            
+            if documents:
+                embeddings = self.embed_documents(documents)
+                
+                # Store in the site's vector index
+                with metrics.timer(f"{self.site_backend}_add"):
+                    self.collection.add(ids, embeddings, documents, metadatas)
+                metrics.increment("chunks_stored", len(documents))
+                
+                self.registry.update(self.site, last_crawl=time.time())
+                self.refresh_site_stats()
+                report.success(f"💾 Stored {len(documents)} content chunks in persistent database")
+                return True
+            
+        except Exception as e:
+            report.error(f"Error storing content: {e}")
+            return False
+    
+    def search_content(self, query, n_results=5, website_url=None):
+        """Search stored content of the active site (or of website_url when given)"""
+        if website_url and not self.use_site(website_url):
+            return []
+        if not self.collection or not self.encoder:
+            return []
+        
+        try:
+            metrics.increment("queries")
+            with metrics.timer("embedding_query"):
+                query_embedding = self.encoder.encode([query], normalize_embeddings=True)[0].tolist()
+            with metrics.timer(f"{self.site_backend}_query"):
+                search_results = self.collection.query(query_embedding, n_results)
+            
+            if self.site:
+                self.last_queries[self.site] = time.time()
+                if time.time() - self.last_flush > self.query_flush_interval:
+                    self.flush_last_queries()
+            
+            return search_results
+            
+        except Exception as e:
+            report.error(f"Error searching content: {e}")
+            return []
+    
+    def get_collection_stats(self):
+        """Get statistics about stored content"""
+        if not self.collection:
+            return None
+        
+        try:
+            count = self.collection.count()
+            return {
+                'total_chunks': count,
+                'collection_name': self.collection.name,
+                'site': self.site
+            }
+        except Exception as e:
+            report.error(f"Error getting stats: {e}")
+            return None
+
+def build_prompt(query, relevant_content):
+    """Assemble the answer prompt from retrieved chunks"""
+    # Prepare context from relevant content
+    context = ""
+    for i, item in enumerate(relevant_content):
+        metadata = item.get('metadata', {})
+        content = item.get('content', '')
+        context += f"\n\nSource {i+1} (from {metadata.get('title', 'Unknown')}):\n{content}"
+    
+    return f"""Based on the following website content (including text extracted from images), please answer the user's question accurately and helpfully.
+
+Website Content:
+{context}
+
+User Question: {query}
+
+Instructions:
+1. Answer based only on the provided website content
+2. If the information isn't available in the content, say so
+3. Include relevant source references when possible
+4. Be concise but comprehensive
+5. If you reference specific information, mention which source it came from
+
+Answer:"""
+
+def generate_response_with_gemini(query, relevant_content, api_key):
+    """Generate response using Gemini AI"""
+    try:
+        genai.configure(api_key=api_key)
+        model = genai.GenerativeModel('gemini-1.5-flash')
+        
+        prompt = build_prompt(query, relevant_content)
+        
+        with metrics.timer("llm_call"):
+            response = model.generate_content(prompt)
+        metrics.increment("llm_calls")
+        return response.text
+        
+    except Exception as e:
+        return f"Error generating response: {e}"
@@ -0,0 +1,289 @@
+# Local Query Service for the Advanced Website Chatbot
+# Owns one encoder, the vector indexes and the Gemini client for every Streamlit session and other clients
+
+import argparse
+import asyncio
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from aiohttp import web
+import google.generativeai as genai
+
+from chatbot_pipeline import (
+    PersistentVectorStorage,
+    VECTOR_BACKENDS,
+    build_prompt,
+    metrics,
+    site_key,
+)
+
+class QueryBatcher:
+    """Collects queries arriving together and embeds them with a single encoder call"""
+    def __init__(self, encoder, executor, max_batch=32, max_wait_ms=5):
+        self.encoder = encoder
+        self.executor = executor
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.queue = asyncio.Queue()
+
+    async def embed(self, text):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((text, future))
+        return await future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            texts = [text for text, _ in batch]
+            started = time.perf_counter()
+            try:
+                vectors = await loop.run_in_executor(
+                    self.executor, partial(self.encoder.encode, texts, normalize_embeddings=True)
+                )
+                for (_, future), vector in zip(batch, vectors):
+                    if not future.done():
+                        future.set_result(vector.tolist())
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+            metrics.observe("embedding_query_batch", time.perf_counter() - started)
+            metrics.increment("query_batches")
+            metrics.increment("queries_batched", len(batch))
+
+class QueryService:
+    def __init__(self, persist_directory="./chroma_db", backend="chroma", api_key=None,
+                 model_name="gemini-1.5-flash", workers=4, max_batch=32, max_wait_ms=5, flush_interval=30):
+        self.storage = PersistentVectorStorage(persist_directory=persist_directory, backend=backend)
+        if not self.storage.initialize_storage():
+            raise RuntimeError(f"Could not initialize storage at {persist_directory}")
+        self.storage.import_legacy_collection()
+
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.batcher_settings = (max_batch, max_wait_ms)
+        self.batcher = None
+        self.ingest_lock = None
+        # Registry snapshot, reloaded only when the file changes
+        self.sites = {}
+        self.sites_stamp = None
+        # Open site indexes, keyed by site: (collection, backend, index)
+        self.indexes = {}
+        self.indexes_lock = threading.Lock()
+        # last_query times are kept in memory and written to the registry every flush_interval seconds
+        self.last_queries = {}
+        self.flush_interval = flush_interval
+
+        self.model = None
+        if api_key:
+            genai.configure(api_key=api_key)
+            self.model = genai.GenerativeModel(model_name)
+
+    async def start(self, app):
+        self.batcher = QueryBatcher(self.storage.encoder, self.executor, *self.batcher_settings)
+        self.ingest_lock = asyncio.Lock()
+        app['batcher_task'] = asyncio.create_task(self.batcher.run())
+        app['flush_task'] = asyncio.create_task(self.flush_periodically())
+
+    async def stop(self, app):
+        app['batcher_task'].cancel()
+        app['flush_task'].cancel()
+        await self.flush_last_queries()
+        self.executor.shutdown(wait=False)
+
+    async def run(self, func, *args, **kwargs):
+        """Run blocking storage work on the thread pool"""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, partial(func, *args, **kwargs))
+
+    def list_sites(self):
+        """Registry contents, re-read only after another writer replaced the file"""
+        try:
+            stat = os.stat(self.storage.registry.path)
+            stamp = stat.st_ino, stat.st_mtime_ns
+        except OSError:
+            stamp = None
+        if stamp != self.sites_stamp:
+            self.sites = self.storage.registry.list_sites()
+            self.sites_stamp = stamp
+        return self.sites
+
+    def site_index(self, website_url):
+        """Return (index, backend) for a registered site, reopening it if the registry changed"""
+        key = site_key(website_url)
+        entry = self.list_sites().get(key)
+        if not entry:
+            return None, None
+
+        backend = entry.get('backend', 'chroma')
+        with self.indexes_lock:
+            cached = self.indexes.get(key)
+            if cached and cached[:2] == (entry['collection'], backend):
+                return cached[2], backend
+
+            index, _ = self.storage.get_backend(backend).open_collection(entry['collection'])
+            self.indexes[key] = (entry['collection'], backend, index)
+            return index, backend
+
+    async def flush_last_queries(self):
+        # Swapped on the event loop, so searches never write into the batch being saved
+        pending, self.last_queries = self.last_queries, {}
+        if pending:
+            await self.run(self.storage.registry.record_queries, pending)
+
+    async def flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush_last_queries()
+
+    async def search(self, query, website_url, n_results=5):
+        index, backend = await self.run(self.site_index, website_url) if website_url else (None, None)
+        if index is None:
+            return []
+
+        metrics.increment("queries")
+        embedding = await self.batcher.embed(query)
+
+        started = time.perf_counter()
+        results = await self.run(index.query, embedding, n_results)
+        metrics.observe(f"{backend}_query", time.perf_counter() - started)
+
+        self.last_queries[site_key(website_url)] = time.time()
+        return results
+
+    async def generate(self, query, results):
+        if not self.model:
+            return "Error generating response: the query service has no GEMINI_API_KEY configured"
+        try:
+            with metrics.timer("llm_call"):
+                response = await self.model.generate_content_async(build_prompt(query, results))
+            metrics.increment("llm_calls")
+            return response.text
+        except Exception as e:
+            return f"Error generating response: {e}"
+
+    async def ingest(self, website_url, content):
+        # store_content switches the storage's active site, so ingestion runs one at a time
+        async with self.ingest_lock:
+            stored = await self.run(self.storage.store_content, content, website_url)
+            with self.indexes_lock:
+                self.indexes.pop(site_key(website_url), None)
+        return stored
+
+    # HTTP handlers
+
+    async def handle_health(self, request):
+        sites = await self.run(self.list_sites)
+        return web.json_response({'status': 'ok', 'sites': len(sites)})
+
+    async def handle_sites(self, request):
+        return web.json_response(await self.run(self.list_sites))
+
+    async def read_payload(self, request):
+        """Request body as a JSON object, or 400"""
+        try:
+            payload = await request.json()
+        except ValueError:
+            raise web.HTTPBadRequest(text="Request body must be JSON")
+        if not isinstance(payload, dict):
+            raise web.HTTPBadRequest(text="Request body must be a JSON object")
+        return payload
+
+    async def read_query(self, request):
+        payload = await self.read_payload(request)
+        query, site, n_results = payload.get('query'), payload.get('site'), payload.get('n_results', 5)
+        if not isinstance(query, str) or not query.strip():
+            raise web.HTTPBadRequest(text="'query' is required")
+        if site is not None and not isinstance(site, str):
+            raise web.HTTPBadRequest(text="'site' must be a URL string")
+        if isinstance(n_results, bool) or not isinstance(n_results, int) or not 1 <= n_results <= 100:
+            raise web.HTTPBadRequest(text="'n_results' must be an integer between 1 and 100")
+        return query, site, n_results
+
+    async def handle_search(self, request):
+        query, site, n_results = await self.read_query(request)
+        return web.json_response({'results': await self.search(query, site, n_results)})
+
+    async def handle_ask(self, request):
+        query, site, n_results = await self.read_query(request)
+        results = await self.search(query, site, n_results)
+        answer = await self.generate(query, results) if results else None
+        return web.json_response({'results': results, 'answer': answer})
+
+    async def handle_ingest(self, request):
+        payload = await self.read_payload(request)
+        website_url, content = payload.get('website_url'), payload.get('content')
+        if not isinstance(website_url, str) or not website_url or not content:
+            raise web.HTTPBadRequest(text="'website_url' and 'content' are required")
+        if not isinstance(content, list) or not all(isinstance(item, dict) and isinstance(item.get('url'), str)
+                                                    for item in content):
+            raise web.HTTPBadRequest(text="'content' must be a list of scraped pages with a 'url'")
+        stored = await self.ingest(payload['website_url'], payload['content'])
+        sites = await self.run(self.list_sites)
+        return web.json_response({
+            'stored': bool(stored),
+            'site': sites.get(site_key(payload['website_url']))
+        })
+
+    async def handle_metrics(self, request):
+        return web.Response(text=metrics.export_prometheus(), content_type="text/plain")
+
+    async def handle_metrics_json(self, request):
+        return web.json_response(metrics.snapshot())
+
+    def create_app(self):
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.on_startup.append(self.start)
+        app.on_cleanup.append(self.stop)
+        app.add_routes([
+            web.get("/health", self.handle_health),
+            web.get("/sites", self.handle_sites),
+            web.post("/search", self.handle_search),
+            web.post("/ask", self.handle_ask),
+            web.post("/ingest", self.handle_ingest),
+            web.get("/metrics", self.handle_metrics),
+            web.get("/metrics.json", self.handle_metrics_json),
+        ])
+        return app
+
+def main():
+    parser = argparse.ArgumentParser(description="Shared retrieval and generation service for the chatbot")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--persist-directory", default="./chroma_db")
+    parser.add_argument("--backend", default=os.getenv("VECTOR_BACKEND", "chroma"), choices=list(VECTOR_BACKENDS),
+                        help="Vector backend for newly ingested sites")
+    parser.add_argument("--workers", type=int, default=4, help="Threads for encoder and index calls")
+    parser.add_argument("--max-batch", type=int, default=32, help="Most queries embedded in one encoder call")
+    parser.add_argument("--max-wait-ms", type=float, default=5, help="How long to wait for more queries to batch")
+    parser.add_argument("--flush-interval", type=float, default=30, help="Seconds between registry writes of query times")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(name)s: %(message)s")
+
+    service = QueryService(
+        persist_directory=args.persist_directory,
+        backend=args.backend,
+        api_key=os.getenv("GEMINI_API_KEY"),
+        workers=args.workers,
+        max_batch=args.max_batch,
+        max_wait_ms=args.max_wait_ms,
+        flush_interval=args.flush_interval
+    )
+    web.run_app(service.create_app(), host=args.host, port=args.port)
+
+if __name__ == "__main__":
+    main()